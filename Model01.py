@@ -1,26 +1,11 @@
-from transformers import pipeline 
-
-import os     
-# for disabling the merro messages 
-
 import os
+# for disabling the merro messages
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"   # disables oneDNN messages
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"   # hides TensorFlow warnings/info
 
-
-
-# pipeline = easy shortcut to use ML models.
-# You don’t have to:
-
-# Load tokenizer manually
-
-# Convert text to numbers
-
-# Run the model step by step
-
-# mental health  calssifier 
-
-mhClassifier =  pipeline("text-classification" , model  = HF_TOKEN)
+# the classifier , its settings and the threshold all come from safety_pipeline now
+# (same model load and same check as the app , so they never drift apart !!!)
+from safety_pipeline import check_mental_health, get_model_loader, load_mental_health_classifier
 
 
 
@@ -33,39 +18,30 @@ mhClassifier =  pipeline("text-classification" , model  = HF_TOKEN)
 
 # Run the model step by step
 
-# mental health  calssifier 
-
-mhClassifier =  pipeline("text-classification" , model  = "tahaenesaslanturk/mental-health-classification-v0.2" , token =HF_TOKEN)
+# mental health  calssifier
+# transformers / torch are only imported inside the loader thread , so the prompt shows up at once
+# CLASSIFIER_MODEL_PATH=/path/to/snapshot loads it from disk with no hub lookups !!!
+# the loader is a singleton , asking for it again gives the same model (loaded only once per process)
+mhLoader = get_model_loader()
 
-# 
+# pranavpsv/bert-base-uncased-mental-health due  to of authentication and token issue i am using this
 
-# pranavpsv/bert-base-uncased-mental-health due  to of authentication and token issue i am using this 
- 
 # making the function for the checking ;
 
 def checker_mentalHealth(UserText):
-    result =  mhClassifier(UserText)[0]
-    label , MentalHealthScore = result['label'], result["score"]
-
-    return label , MentalHealthScore 
-
-
-# pranavpsv/bert-base-uncased-mental-health due  to of authentication and token issue i am using this 
- 
-# making the function for the checking ;
-
-def checker_mentalHealth(UserText):
-    result =  mhClassifier(UserText)[0]
-    label , MentalHealthScore = result['label'], result["score"]
-
-    return label , MentalHealthScore 
-
+    mhClassifier = load_mental_health_classifier()
+    if mhClassifier is None:
+        raise RuntimeError(f"mental health classifier failed to load: {mhLoader.error}")
+    label , MentalHealthScore = check_mental_health(UserText, mhClassifier)
 
-text =  input("Enter the text for checking :) "  )
+    return label , MentalHealthScore
 
-output01 ,  output02  =  checker_mentalHealth(text)
 
-print(output01)
-print(output02)
+if __name__ == "__main__":
+    text =  input("Enter the text for checking :) "  )
 
+    output01 ,  output02  =  checker_mentalHealth(text)
 
+    print(output01)
+    print(output02)
+    print("startup:", mhLoader.describe_timings())
@@ -0,0 +1,356 @@
+"""HTTP and WebSocket API for the safety pipeline, without Streamlit
+
+Other frontends call the same pipeline as app.py over HTTP, so they do
+not pay for a Streamlit script rerun on every interaction. The server
+runs on asyncio (aiohttp, `pip install aiohttp`); classifier calls and
+Gemma streams are blocking, so each one runs on a worker thread and its
+events are handed back to the event loop. The classifier, the Ollama
+client, the caches and the generation queue are the process-wide
+instances from safety_pipeline, shared by every request.
+
+    python api_server.py --host 127.0.0.1 --port 8080
+
+Endpoints:
+
+    GET  /health          classifier and Gemma status, generation queue and session memory numbers
+    GET  /metrics         Prometheus text, same registry as METRICS_PORT
+    POST /classify        {"text": ...} -> {"label", "score", "critical"}
+    POST /classify/batch  {"texts": [...]} -> {"results": [{"label", "score", "critical"}, ...]}
+    POST /chat            {"text": ..., "session_id": ...} -> Server-Sent Events,
+                          or one JSON object with "stream": false
+    GET  /chat/ws         WebSocket; send {"text": ..., "session_id": ...} per message
+
+A chat turn produces these events, in order: `classification` (label,
+score, alert), `queue` (position, only while Gemma is busy), `token`
+(text, one per reply token) or `alert` (message), and `done` (reply,
+alert, label, score, id). Over SSE each is an `event:` line plus a JSON
+`data:` line; over the WebSocket each is {"event": ..., "data": {...}}.
+
+Turns are written to the chat store under their session id (a new one is
+made when none is given), so the conversation memory and the rolling
+risk carry over between requests of the same session. Sessions are held
+by the same session manager as the Streamlit app: capped in memory and
+evicted to the chat store when idle.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import textwrap
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from aiohttp import WSMsgType, web
+except ImportError as e:
+    raise ImportError("api_server.py needs aiohttp: pip install aiohttp") from e
+
+from metrics import REGISTRY
+from safety_pipeline import (
+    ALERT_RULE, CONFIG, chatbot_pipeline, check_mental_health, check_mental_health_batch, crisis_phrase,
+    get_chat_store, get_generation_scheduler, get_model_loader, get_session_manager, join_reply,
+    load_mental_health_classifier, new_chat_entry
+)
+from safety_rules import is_critical
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_CHARS = 10000
+
+
+def get_session(session_id=None):
+    """SessionState of a conversation, a new one when no id is given"""
+    return get_session_manager().get(session_id or uuid.uuid4().hex)
+
+
+class ApiError(Exception):
+    """Answered as {"error": message} with the given HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def run_chat_turn(session, text, emit, cancelled):
+    """One chat turn through the pipeline (blocking); events go to emit(event, data)"""
+    # One turn at a time per conversation; other sessions run in parallel
+    with session.lock:
+        classifier = load_mental_health_classifier()
+        if classifier is None:
+            raise ApiError(503, "The mental health classifier is not available")
+
+        started_at = time.perf_counter()
+        reply, alert, label, score = chatbot_pipeline(
+            text, classifier, stream=True, speculative=CONFIG.speculative_generation,
+            risk_tracker=session.risk_tracker, conversation=session.conversation,
+            on_queue=lambda position: emit("queue", {"position": position}), cancelled=cancelled
+        )
+        emit("classification", {"label": label, "score": score, "alert": alert is not None})
+
+        first_token_latency = None
+        if alert is not None:
+            alert = textwrap.dedent(alert).strip()
+            emit("alert", {"message": alert})
+        else:
+            parts = []
+            try:
+                for token in reply:
+                    if cancelled.is_set():
+                        # The client went away; closing the generator stops Gemma
+                        return
+                    if first_token_latency is None:
+                        first_token_latency = time.perf_counter() - started_at
+                    parts.append(token)
+                    emit("token", {"text": token})
+            finally:
+                reply.close()
+            if cancelled.is_set():
+                # The generation gave up waiting for a client that is gone
+                return
+            reply = join_reply(parts)
+
+        entry = get_chat_store().append(
+            session.session_id, new_chat_entry(text, reply, alert, label, score, first_token_latency)
+        )
+        session.add_turn(entry)
+        get_session_manager().trim(session)
+        emit("done", {"reply": reply, "alert": alert, "label": label, "score": score, "id": entry["id"]})
+
+
+async def iter_chat_events(request, session, text):
+    """Run a chat turn on a worker thread and yield its (event, data) as they happen"""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+    finished = object()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def work():
+        try:
+            run_chat_turn(session, text, emit, cancelled)
+        except ApiError as e:
+            emit("error", {"message": str(e), "status": e.status})
+        except Exception as e:
+            logger.exception("Chat turn failed")
+            emit("error", {"message": f"{type(e).__name__}: {e}", "status": 500})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, finished)
+
+    future = loop.run_in_executor(request.app["executor"], work)
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), 1.0)
+            except asyncio.TimeoutError:
+                # Nothing is written while a turn waits for a slot, so look for a dropped client
+                if request.transport is None or request.transport.is_closing():
+                    break
+                continue
+            if item is finished:
+                break
+            yield item
+    finally:
+        # Also reached when the client disconnects mid-reply
+        cancelled.set()
+        await future
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ApiError(400, "The request body must be JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "The request body must be a JSON object")
+    return body
+
+
+def validate_text(value, field="text"):
+    if not isinstance(value, str) or not value.strip():
+        raise ApiError(400, f'"{field}" must be a non-empty string')
+    if len(value) > MAX_TEXT_CHARS:
+        raise ApiError(413, f'"{field}" is longer than {MAX_TEXT_CHARS} characters')
+    return value
+
+
+async def run_blocking(request, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(request.app["executor"], func, *args)
+
+
+async def get_classifier(request):
+    classifier = await run_blocking(request, load_mental_health_classifier)
+    if classifier is None:
+        raise ApiError(503, "The mental health classifier is not available")
+    return classifier
+
+
+def classification_json(text, label, score):
+    # A crisis phrase raises the chat alert whatever the score, so it counts as critical here too
+    return {"label": label, "score": score,
+            "critical": is_critical(label, score, **ALERT_RULE) or crisis_phrase(text) is not None}
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except ApiError as e:
+        return web.json_response({"error": str(e)}, status=e.status)
+
+
+async def health(request):
+    loader = get_model_loader()
+    return web.json_response({
+        "classifier": loader.status,
+        "classifier_error": str(loader.error) if loader.error is not None else None,
+        "gemma": bool(CONFIG.gemma_url),
+        "generation_queue": get_generation_scheduler().stats(),
+        "sessions": get_session_manager().stats(),
+    })
+
+
+async def metrics(request):
+    return web.Response(text=REGISTRY.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def classify(request):
+    text = validate_text((await read_json(request)).get("text"))
+    classifier = await get_classifier(request)
+    with REGISTRY.timer("classification"):
+        label, score = await run_blocking(request, check_mental_health, text, classifier)
+    REGISTRY.inc("classifications", label=label.lower())
+    return web.json_response(classification_json(text, label, score))
+
+
+async def classify_batch(request):
+    texts = (await read_json(request)).get("texts")
+    if not isinstance(texts, list) or not texts:
+        raise ApiError(400, '"texts" must be a non-empty list of strings')
+    if len(texts) > request.app["max_batch"]:
+        raise ApiError(413, f'"texts" has more than {request.app["max_batch"]} items')
+    for index, text in enumerate(texts):
+        validate_text(text, f"texts[{index}]")
+
+    classifier = await get_classifier(request)
+    results = await run_blocking(request, check_mental_health_batch, texts, classifier)
+    for label, _ in results:
+        REGISTRY.inc("classifications", label=label.lower())
+    return web.json_response({"results": [
+        classification_json(text, label, score) for text, (label, score) in zip(texts, results)
+    ]})
+
+
+async def chat(request):
+    body = await read_json(request)
+    text = validate_text(body.get("text"))
+    session = get_session(body.get("session_id"))
+
+    if not body.get("stream", True):
+        result = {"session_id": session.session_id}
+        async with contextlib.aclosing(iter_chat_events(request, session, text)) as events:
+            async for event, data in events:
+                if event == "error":
+                    raise ApiError(data["status"], data["message"])
+                if event == "done":
+                    result.update(data)
+        return web.json_response(result)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    await write_sse(response, "session", {"session_id": session.session_id})
+    try:
+        async with contextlib.aclosing(iter_chat_events(request, session, text)) as events:
+            async for event, data in events:
+                await write_sse(response, event, data)
+    except ConnectionResetError:
+        # The generator's cleanup has already cancelled the generation
+        logger.info("Client left during a streamed reply (session %s)", session.session_id)
+    return response
+
+
+async def write_sse(response, event, data):
+    await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+
+async def chat_websocket(request):
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    session_id = request.query.get("session_id")
+
+    async for message in ws:
+        if message.type != WSMsgType.TEXT:
+            continue
+        try:
+            body = json.loads(message.data)
+            if not isinstance(body, dict):
+                raise ApiError(400, "Each message must be a JSON object")
+            text = validate_text(body.get("text"))
+        except json.JSONDecodeError:
+            await ws.send_json({"event": "error", "data": {"message": "Messages must be JSON", "status": 400}})
+            continue
+        except ApiError as e:
+            await ws.send_json({"event": "error", "data": {"message": str(e), "status": e.status}})
+            continue
+
+        session = get_session(body.get("session_id") or session_id)
+        session_id = session.session_id
+        await ws.send_json({"event": "session", "data": {"session_id": session_id}})
+        try:
+            async with contextlib.aclosing(iter_chat_events(request, session, text)) as events:
+                async for event, data in events:
+                    await ws.send_json({"event": event, "data": data})
+        except ConnectionResetError:
+            logger.info("Client left during a streamed reply (session %s)", session_id)
+            break
+    return ws
+
+
+def create_app(workers=64, max_batch=256):
+    """aiohttp application; starts loading the classifier when the server starts"""
+    app = web.Application(middlewares=[error_middleware])
+    app["max_batch"] = max_batch
+
+    async def start(app):
+        # Blocking turns (queue waits included) each hold a thread while they run
+        app["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        get_model_loader()
+
+    async def stop(app):
+        app["executor"].shutdown(wait=False, cancel_futures=True)
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/classify", classify)
+    app.router.add_post("/classify/batch", classify_batch)
+    app.router.add_post("/chat", chat)
+    app.router.add_get("/chat/ws", chat_websocket)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP / WebSocket API for the safety pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=64,
+                        help="threads for classifier calls and Gemma streams (each open chat holds one)")
+    parser.add_argument("--max-batch", type=int, default=256, help="most texts per /classify/batch request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    web.run_app(create_app(args.workers, args.max_batch), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 import streamlit as st
 import os
-import requests
-import json
-from transformers import pipeline
 from dotenv import load_dotenv
+from metrics import REGISTRY, start_metrics_server
+import safety_pipeline as pipeline
+from safety_pipeline import (
+    CONFIG, chatbot_pipeline, get_chat_store, get_classification_cache,
+    get_generation_scheduler, get_model_loader, get_ollama_client, get_reply_cache, get_session_manager,
+    join_reply, new_chat_entry
+)
 from datetime import datetime
+import logging
+import sys
+import tempfile
+import textwrap
 import time
+import uuid
 
 # Page configuration
 st.set_page_config(
@@ -18,9 +27,18 @@ st.set_page_config(
 # Load environment variables
 load_dotenv()
 
-# Environment variables
-HF_TOKEN = os.getenv("HF_API_TOKEN")
-GEMMA_URL = os.getenv("GEMMA_API_URL")
+# Startup timings and other diagnostics go to the console
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+# UI settings; the pipeline settings are read by safety_pipeline
+# Render Gemma tokens as they arrive instead of waiting for the full reply
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() in ("1", "true", "yes")
+# Turns rendered per page; "Load older messages" adds another page
+CHAT_RENDER_WINDOW = int(os.getenv("CHAT_RENDER_WINDOW", "20"))
+# Prometheus-style /metrics on this port (0 = off) and the latency panel in the sidebar
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+ADMIN_PANEL = os.getenv("ADMIN_PANEL", "false").lower() in ("1", "true", "yes")
+
 
 # Custom CSS for better styling
 st.markdown("""
@@ -94,140 +112,200 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_resource
-def load_mental_health_classifier():
-    """Load the mental health classifier model"""
-    try:
-        classifier = pipeline(
-            "text-classification",
-            model="tahaenesaslanturk/mental-health-classification-v0.2",
-            token=HF_TOKEN
-        )
-        return classifier
-    except Exception as e:
-        st.error(f"Failed to load mental health classifier: {str(e)}")
-        return None
-
-def check_mental_health(user_text, classifier):
-    """Check mental health status of user input"""
-    if not classifier:
-        return "unknown", 0.0
+def load_mental_health_classifier(wait=True):
+    """Load the mental health classifier model
     
-    try:
-        result = classifier(user_text)[0]
-        label, score = result['label'], result['score']
-        return label, score
-    except Exception as e:
-        st.error(f"Error in mental health classification: {str(e)}")
-        return "error", 0.0
+    With wait=False this returns None while the model is still loading
+    instead of blocking the page render.
+    """
+    classifier = pipeline.load_mental_health_classifier(wait)
+    loader = get_model_loader()
+    if loader.error is not None:
+        st.error(f"Failed to load mental health classifier: {str(loader.error)}")
+    return classifier
 
-def get_chat_response(user_text):
-    """Get response from Gemma AI model"""
-    if not GEMMA_URL:
-        return "[Error] Gemma API URL not configured"
-    
-    values = {
-        "model": "gemma:2b",
-        "prompt": f"User: {user_text}\nAssistant:",
-        "stream": True
-    }
-    
-    try:
-        response = requests.post(GEMMA_URL, json=values, stream=True, timeout=60)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        return f"[Error] Could not reach Gemma API: {str(e)}"
+def render_streaming_reply(placeholder, tokens, started_at):
+    """Render reply tokens incrementally and return (reply, time to first token)"""
+    parts = []
+    first_token_latency = None
+    for token in tokens:
+        if first_token_latency is None:
+            first_token_latency = time.perf_counter() - started_at
+        parts.append(token)
+        placeholder.markdown(f"""
+        <div class="bot-message">
+            <strong>🤖 Bot:</strong> {"".join(parts)}▌
+        </div>
+        """, unsafe_allow_html=True)
     
-    full_reply = ""
+    return join_reply(parts), first_token_latency
+
+@st.cache_resource
+def get_metrics_server():
+    """Serve /metrics once per process when METRICS_PORT is set"""
+    if METRICS_PORT <= 0:
+        return None
     try:
-        for line in response.iter_lines():
-            if line:
-                data = json.loads(line.decode("utf-8"))
-                if "response" in data:
-                    full_reply += data["response"]
-                if data.get("done"):
-                    break
-    except json.JSONDecodeError as e:
-        return f"[Error] Failed to parse API response: {str(e)}"
-    
-    return full_reply.strip() if full_reply.strip() else "I apologize, but I couldn't generate a response."
+        return start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        logging.getLogger(__name__).warning("Metrics endpoint not started on port %d: %s", METRICS_PORT, e)
+        return None
 
-def chatbot_pipeline(user_text, classifier):
-    """Main chatbot pipeline with mental health checking"""
-    # Mental health check
-    label, score = check_mental_health(user_text, classifier)
-    
-    # Configuration
-    THRESHOLD = 0.7
-    CRITICAL_LABELS = ["suicidewatch", "suicidal", "depression", "stress", "anxiety"]
-    
-    # Check for critical mental health indicators
-    if label.lower() in CRITICAL_LABELS and score > THRESHOLD:
-        alert_msg = f"""
-        🚨 **Critical Mental Health Alert Detected**
-        
-        **Detected Issue**: {label.title()}
-        **Confidence Level**: {score:.1%}
+def display_latency_metrics():
+    """Admin panel: per-stage latency and alert counts since the process started"""
+    with st.expander("⏱️ Latency Metrics (admin)"):
+        summary = REGISTRY.stage_summary()
+        if not summary:
+            st.caption("No messages processed yet.")
+        else:
+            # Percentiles are bucket upper bounds, in milliseconds
+            st.table({
+                stage: {
+                    "count": values["count"],
+                    "mean ms": round(values["mean"] * 1000, 1),
+                    "p50 ms": values["p50"] * 1000,
+                    "p95 ms": values["p95"] * 1000,
+                    "p99 ms": values["p99"] * 1000,
+                }
+                for stage, values in sorted(summary.items())
+            })
         
-        **Immediate Support Available**:
-        • **AASRA Helpline (India)**: 9152987821
-        • **National Suicide Prevention Lifeline**: 988
-        • **Crisis Text Line**: Text HOME to 741741
+        alerts = REGISTRY.counter_values("alerts")
+        if alerts:
+            st.markdown("**Alerts fired**")
+            for labels, count in sorted(alerts, key=lambda item: -item[1]):
+                st.markdown(f"- {labels['label'].title()} ({labels['kind']}): {count}")
+
+        client = get_ollama_client() if CONFIG.gemma_url else None
+        if hasattr(client, "stats"):
+            st.markdown("**Gemma backends**")
+            st.table({
+                backend["url"]: {
+                    "healthy": "yes" if backend["healthy"] else "no",
+                    "in flight": backend["outstanding"],
+                    "requests": backend["requests"],
+                    "failures": backend["failures"],
+                    "ttft p50 ms": round(backend["ttft_p50"] * 1000) if backend["ttft_p50"] is not None else "-",
+                    "ttft p95 ms": round(backend["ttft_p95"] * 1000) if backend["ttft_p95"] is not None else "-",
+                }
+                for backend in client.stats()
+            })
         
-        Please reach out to a mental health professional or trusted person immediately.
-        Your life matters, and help is available. 💙
-        """
-        return None, alert_msg, label, score
-    
-    # Normal conversation
-    reply = get_chat_response(user_text)
-    return reply, None, label, score
+        sessions = get_session_manager().stats()
+        st.markdown("**Session memory**")
+        st.caption(
+            f"{sessions['resident']} sessions in memory · {sessions['bytes'] / 1024:.0f} KB "
+            f"(largest {sessions['largest_bytes'] / 1024:.0f} KB, {sessions['turns']} turns) · "
+            f"evicted when idle: {sessions['evicted']} · restored: {sessions['restored']} · "
+            f"turns trimmed: {sessions['trimmed_turns']}"
+        )
+        st.caption(
+            f"Chat store: {sessions['store_bytes'] / 1024:.0f} KB "
+            f"{'in memory' if sessions['store_in_memory'] else 'on disk'} · "
+            f"conversations pruned: {sessions['pruned']}"
+        )
+
+def new_session_id():
+    """Start a new conversation id and put it in the URL"""
+    session_id = uuid.uuid4().hex
+    st.experimental_set_query_params(**{**st.experimental_get_query_params(), "sid": session_id})
+    return session_id
+
+def get_session_id():
+    """Conversation id kept in the URL so a page refresh finds the same history
+
+    Whoever has the URL can open the conversation, which the privacy
+    notice tells the user; "Clear Chat History" replaces the id.
+    """
+    session_id = st.experimental_get_query_params().get("sid", [None])[0]
+    return session_id or new_session_id()
 
 def initialize_session_state():
-    """Initialize session state variables"""
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
-    if 'mental_health_stats' not in st.session_state:
-        st.session_state.mental_health_stats = {}
-    if 'total_messages' not in st.session_state:
-        st.session_state.total_messages = 0
+    """Initialize session state variables
+    
+    Only the ids live in Streamlit's session state; the history page,
+    stats, rolling risk and Gemma memory are held by the session manager,
+    which caps them and evicts idle sessions.
+    """
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = get_session_id()
+    if 'history_window' not in st.session_state:
+        st.session_state.history_window = CHAT_RENDER_WINDOW
 
-def update_mental_health_stats(label):
-    """Update mental health statistics"""
-    if label in st.session_state.mental_health_stats:
-        st.session_state.mental_health_stats[label] += 1
+def current_session():
+    """This conversation's SessionState, restored from the store if it was evicted"""
+    return get_session_manager().get(st.session_state.session_id)
+
+def render_turn_html(chat):
+    """HTML for one finished turn: the user message plus the reply or alert"""
+    # User message
+    html = textwrap.dedent(f"""
+        <div class="user-message">
+            <strong>You:</strong> {chat['user_input']}
+            <div class="timestamp">{chat['timestamp']}</div>
+        </div>
+        """)
+    
+    # Bot response or alert
+    if chat.get('alert'):
+        html += textwrap.dedent(f"""
+            <div class="alert-message">
+                <strong>&#x1F6A8; Mental Health Alert</strong><br>
+                {chat['alert']}
+            </div>
+            """)
     else:
-        st.session_state.mental_health_stats[label] = 1
+        latency = ""
+        if chat.get('first_token_latency') is not None:
+            latency = f" · First token: {chat['first_token_latency']:.2f}s"
+        html += textwrap.dedent(f"""
+            <div class="bot-message">
+                <strong>&#x1F916; Bot:</strong> {chat['bot_response']}
+                <div class="timestamp">Mental Health Status: {chat['mental_health_label']} ({chat['mental_health_score']:.1%}){latency}</div>
+            </div>
+            """)
+    # One emoji makes Python store the whole cached string at 4 bytes per character;
+    # as HTML entities it stays at 1. Text in another script (Devanagari, Cyrillic)
+    # is smaller as it is, so the entities are only kept when they save memory
+    escaped = html.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    return escaped if sys.getsizeof(escaped) < sys.getsizeof(html) else html
 
-def display_chat_history():
-    """Display chat history with improved formatting"""
-    if st.session_state.chat_history:
+def load_older_turns():
+    """Show one more page of older turns, reading them from the store if needed"""
+    session = current_session()
+    history = session.turns
+    # The memory cap may have dropped turns that were on screen
+    st.session_state.history_window = min(st.session_state.history_window, len(history))
+    hidden = len(history) - st.session_state.history_window
+    if hidden < CHAT_RENDER_WINDOW and history:
+        older = get_chat_store().recent(
+            session.session_id, CHAT_RENDER_WINDOW - hidden, before_id=history[0]['id']
+        )
+        session.add_older_turns(older)
+    st.session_state.history_window += CHAT_RENDER_WINDOW
+
+def display_chat_history(session):
+    """Display chat history with improved formatting
+    
+    Only the newest turns are rendered, each from HTML cached per turn,
+    so a rerun costs the same however long the conversation gets.
+    """
+    if session.turns:
+        visible = session.turns[-st.session_state.history_window:]
+        if session.total_messages > len(visible):
+            older_count = session.total_messages - len(visible)
+            st.button(f"⬆️ Load older messages ({older_count} more)", on_click=load_older_turns)
+        
         st.markdown('<div class="chat-container">', unsafe_allow_html=True)
         
-        for i, chat in enumerate(st.session_state.chat_history):
-            # User message
-            st.markdown(f"""
-            <div class="user-message">
-                <strong>You:</strong> {chat['user_input']}
-                <div class="timestamp">{chat['timestamp']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Bot response or alert
-            if chat.get('alert'):
-                st.markdown(f"""
-                <div class="alert-message">
-                    <strong>🚨 Mental Health Alert</strong><br>
-                    {chat['alert']}
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class="bot-message">
-                    <strong>🤖 Bot:</strong> {chat['bot_response']}
-                    <div class="timestamp">Mental Health Status: {chat['mental_health_label']} ({chat['mental_health_score']:.1%})</div>
-                </div>
-                """, unsafe_allow_html=True)
+        # Turns never change once written, so their HTML is built only once
+        cached = session.rendered
+        rendered = {}
+        for chat in visible:
+            html = cached.get(chat['id']) or render_turn_html(chat)
+            rendered[chat['id']] = html
+            st.markdown(html, unsafe_allow_html=True)
+        session.rendered = rendered
         
         st.markdown('</div>', unsafe_allow_html=True)
     else:
@@ -237,9 +315,11 @@ def main():
     """Main Streamlit application"""
     # Initialize session state
     initialize_session_state()
+    session = current_session()
+    get_metrics_server()
     
-    # Load classifier
-    classifier = load_mental_health_classifier()
+    # Start loading the classifier without blocking the first render
+    classifier = load_mental_health_classifier(wait=False)
     
     # Header
     st.markdown("""
@@ -258,37 +338,77 @@ def main():
         # Display stats
         st.markdown(f"""
         <div class="stats-box">
-            <strong>Total Messages:</strong> {st.session_state.total_messages}
+            <strong>Total Messages:</strong> {session.total_messages}
         </div>
         """, unsafe_allow_html=True)
         
-        if st.session_state.mental_health_stats:
+        cache = get_classification_cache()
+        if cache is not None:
+            cache_stats = cache.stats()
+            st.markdown(f"""
+            <div class="stats-box">
+                <strong>Classifier Cache:</strong> {cache_stats['hits']} hits / {cache_stats['misses']} misses
+                ({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['size']} entries)
+            </div>
+            """, unsafe_allow_html=True)
+        
+        reply_cache = get_reply_cache()
+        if reply_cache is not None:
+            reply_stats = reply_cache.stats()
+            st.markdown(f"""
+            <div class="stats-box">
+                <strong>Reply Cache:</strong> {reply_stats['exact_hits'] + reply_stats['semantic_hits']} hits
+                ({reply_stats['semantic_hits']} near-duplicate) / {reply_stats['misses']} misses
+                ({reply_stats['hit_rate']:.0%} hit rate, {reply_stats['size']} entries)
+            </div>
+            """, unsafe_allow_html=True)
+        
+        rolling = {label: risk for label, risk in session.risk_tracker.scores().items()
+                   if label in CONFIG.critical_labels and risk >= 0.05}
+        if rolling:
+            top_label = max(rolling, key=rolling.get)
+            st.markdown(f"""
+            <div class="stats-box">
+                <strong>Conversation Risk:</strong> {top_label.title()} {rolling[top_label]:.0%}
+                (alert at {CONFIG.sustained_risk_threshold:.0%})
+            </div>
+            """, unsafe_allow_html=True)
+        
+        if session.label_counts:
             st.subheader("Mental Health Indicators")
-            for label, count in st.session_state.mental_health_stats.items():
+            for label, count in session.label_counts.items():
                 st.markdown(f"""
                 <div class="stats-box">
                     <strong>{label.title()}:</strong> {count} times
                 </div>
                 """, unsafe_allow_html=True)
         
+        if ADMIN_PANEL:
+            display_latency_metrics()
+        
         st.markdown("---")
         
         # Control buttons
         if st.button("🗑️ Clear Chat History", type="secondary"):
-            st.session_state.chat_history = []
-            st.session_state.mental_health_stats = {}
-            st.session_state.total_messages = 0
+            get_chat_store().clear(session.session_id)
+            get_session_manager().discard(session.session_id)
+            # A link copied or kept in the browser history no longer opens this chat
+            st.session_state.session_id = new_session_id()
+            st.session_state.history_window = CHAT_RENDER_WINDOW
             st.rerun()
         
         if st.button("💾 Export Chat", type="secondary"):
-            if st.session_state.chat_history:
-                chat_export = json.dumps(st.session_state.chat_history, indent=2)
-                st.download_button(
-                    label="Download Chat History",
-                    data=chat_export,
-                    file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
+            if session.total_messages:
+                # Stream the log to a temporary file batch by batch
+                with tempfile.TemporaryFile("w+", encoding="utf-8") as chat_export:
+                    get_chat_store().export_json(session.session_id, chat_export)
+                    chat_export.seek(0)
+                    st.download_button(
+                        label="Download Chat History",
+                        data=chat_export,
+                        file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                        mime="application/json"
+                    )
         
         st.markdown("---")
         
@@ -313,7 +433,8 @@ def main():
         st.subheader("💬 Chat Interface")
         
         # Display chat history
-        display_chat_history()
+        with REGISTRY.timer("render"):
+            display_chat_history(session)
         
         # Input form
         with st.form("chat_form", clear_on_submit=True):
@@ -325,28 +446,46 @@ def main():
             submitted = st.form_submit_button("Send Message", type="primary")
             
             if submitted and user_input.strip():
+                if not classifier:
+                    with st.spinner("Loading the mental health classifier..."):
+                        classifier = load_mental_health_classifier()
                 if not classifier:
                     st.error("Mental health classifier not available. Please check your configuration.")
                     return
                 
-                # Show processing message
-                with st.spinner("Processing your message..."):
-                    reply, alert, label, score = chatbot_pipeline(user_input, classifier)
+                started_at = time.perf_counter()
+                first_token_latency = None
+                # Shows the queue position while Gemma is busy, then the reply
+                reply_placeholder = st.empty()
                 
-                # Create chat entry
-                chat_entry = {
-                    'user_input': user_input,
-                    'bot_response': reply,
-                    'alert': alert,
-                    'mental_health_label': label,
-                    'mental_health_score': score,
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
+                def show_queue_position(position):
+                    reply_placeholder.info(f"⏳ Gemma is busy right now. You are number {position} in the queue...")
                 
-                # Update session state
-                st.session_state.chat_history.append(chat_entry)
-                st.session_state.total_messages += 1
-                update_mental_health_stats(label)
+                # The session is not evicted while its turn is being processed
+                with session.lock:
+                    # Show processing message
+                    with st.spinner("Processing your message..."):
+                        reply, alert, label, score = chatbot_pipeline(
+                            user_input, classifier,
+                            stream=STREAM_REPLIES, speculative=CONFIG.speculative_generation,
+                            risk_tracker=session.risk_tracker,
+                            conversation=session.conversation,
+                            on_queue=show_queue_position
+                        )
+                    
+                    if STREAM_REPLIES and reply is not None:
+                        reply, first_token_latency = render_streaming_reply(
+                            reply_placeholder, reply, started_at
+                        )
+                    
+                    # Create chat entry
+                    chat_entry = new_chat_entry(user_input, reply, alert, label, score, first_token_latency)
+                    
+                    # Write the turn to the store, keep only the recent page (within the memory cap) in memory
+                    chat_entry = get_chat_store().append(session.session_id, chat_entry)
+                    session.add_turn(chat_entry)
+                    window = st.session_state.history_window
+                    get_session_manager().trim(session, max(CONFIG.chat_history_page_size, window), min_turns=window)
                 
                 # Rerun to update display
                 st.rerun()
@@ -362,20 +501,42 @@ def main():
         4. Chat history is maintained
         """)
         
-        st.warning("""
-        **Privacy Notice:**
-        Your conversations are processed locally and not stored permanently. 
-        Chat history is cleared when you refresh the page.
-        """)
+        # The sid in the address bar is all it takes to open a conversation
+        link_notice = """
+            The page address (its `sid=` part) opens this conversation: anyone who gets it, from a 
+            shared link, the browser history or a shared computer, can read it. Do not share it; 
+            "Clear Chat History" deletes the chat and stops the old address from working.
+            """
+        if get_chat_store().persistent:
+            st.warning("""
+            **Privacy Notice:**
+            Your conversations are processed locally and saved on this server 
+            so they survive a page refresh. Use "Clear Chat History" to delete them.
+            """ + link_notice)
+        else:
+            st.warning("""
+            **Privacy Notice:**
+            Your conversations are processed locally and not stored permanently. 
+            Chat history is cleared when the app restarts.
+            """ + link_notice)
         
         # Model status
-        if classifier:
+        loader = get_model_loader()
+        if loader.ready:
             st.success("🟢 Mental Health Classifier: Active")
+            st.caption(f"Startup: {loader.describe_timings()}")
+        elif loader.error is None:
+            st.info(f"🟡 Mental Health Classifier: {loader.status.capitalize()}...")
         else:
             st.error("🔴 Mental Health Classifier: Inactive")
         
-        if GEMMA_URL:
+        if CONFIG.gemma_url:
             st.success("🟢 Gemma AI: Connected")
+            queue_stats = get_generation_scheduler().stats()
+            st.caption(
+                f"Generating: {queue_stats['active']}/{CONFIG.generation_max_concurrent} · "
+                f"waiting: {queue_stats['waiting']} · turned away: {queue_stats['shed']}"
+            )
         else:
             st.error("🔴 Gemma AI: Not configured")
 
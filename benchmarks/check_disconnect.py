@@ -0,0 +1,124 @@
+"""Check that a client leaving /chat gives its Gemma slot back
+
+Starts api_server.py and the fake Gemma server, opens streamed chats and
+drops them, once mid-reply and once while the chat is still waiting for
+a generation slot, then reads the generation queue from /health. Both
+leave the scheduler with no active or waiting generation when the
+disconnect cancelled them. It also sends one short message twice, so the
+second turn is answered from the reply cache and must still be stored:
+
+    python benchmarks/check_disconnect.py                  # SPECULATIVE_GENERATION=true
+    python benchmarks/check_disconnect.py --no-speculative
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_ollama import start_fake_ollama  # noqa: E402
+
+
+async def open_chat(http, base, text, until):
+    """Start a streamed /chat and read it up to the first `until` event"""
+    response = await http.post(f"{base}/chat", json={"text": text})
+    event = None
+    async for line in response.content:
+        line = line.decode("utf-8").strip()
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: ") and event in until:
+            return response, event, json.loads(line[len("data: "):])
+    raise SystemExit(f"/chat ended before any of {until}")
+
+
+async def wait_for_idle(http, base, timeout=5.0):
+    """Generation queue stats once nothing is active or waiting, or after timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        async with http.get(f"{base}/health") as response:
+            queue = (await response.json())["generation_queue"]
+        if (queue["active"] == 0 and queue["waiting"] == 0) or time.monotonic() >= deadline:
+            return queue
+        await asyncio.sleep(0.1)
+
+
+async def run_checks(server, text):
+    from aiohttp import ClientSession, web
+
+    from api_server import create_app
+
+    runner = web.AppRunner(create_app(workers=8))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+
+    failures = 0
+    try:
+        async with ClientSession() as http:
+            # Mid-reply: leave after the first token
+            response, event, _ = await open_chat(http, base, text, ("token", "alert"))
+            if event == "alert":
+                raise SystemExit(f"{text!r} raised an alert; pass a message that gets a reply")
+            response.close()
+            queue = await wait_for_idle(http, base)
+            ok = queue["active"] == 0 and queue["waiting"] == 0
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} left mid-reply: {queue}")
+
+            # Queued: one chat holds the only slot, a second one leaves while waiting for it
+            holder, _, _ = await open_chat(http, base, text, ("token",))
+            waiter, _, _ = await open_chat(http, base, text, ("classification",))
+            await asyncio.sleep(0.2)
+            waiter.close()
+            # Noticed within a second or two (the server and the scheduler poll)
+            await asyncio.sleep(3)
+            async with http.get(f"{base}/health") as health:
+                waiting = (await health.json())["generation_queue"]["waiting"]
+            holder.close()
+            queue = await wait_for_idle(http, base)
+            ok = waiting == 0 and queue["active"] == 0 and queue["waiting"] == 0
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} left while queued: {waiting} still waiting, then {queue}")
+
+            # Repeated small talk: the second reply comes from the reply cache
+            server.settings["tokens_per_second"] = 0
+            turns = []
+            for _ in range(2):
+                async with http.post(f"{base}/chat", json={"text": "thanks!", "stream": False}) as response:
+                    turns.append((response.status, await response.json()))
+            ok = (all(status == 200 and "id" in body for status, body in turns)
+                  and turns[0][1]["reply"] == turns[1][1]["reply"])
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} repeated message: {[status for status, _ in turns]}")
+    finally:
+        await runner.cleanup()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that dropped /chat clients release their generation slot")
+    parser.add_argument("--no-speculative", action="store_true", help="start Gemma after classification instead")
+    parser.add_argument("--text", default="Hello, how are you today?", help="a message that gets a normal reply")
+    args = parser.parse_args()
+
+    # Slow enough that every reply is still streaming when its client leaves
+    server, url = start_fake_ollama(latency_ms=100, tokens_per_second=10, reply_tokens=200)
+    os.environ["GEMMA_API_URL"] = url
+    os.environ["SPECULATIVE_GENERATION"] = "false" if args.no_speculative else "true"
+    os.environ["GENERATION_MAX_CONCURRENT"] = "1"
+
+    failures = asyncio.run(run_checks(server, args.text))
+    server.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
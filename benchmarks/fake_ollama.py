@@ -0,0 +1,156 @@
+"""Local stand-in for the Ollama /api/generate endpoint
+
+Replays NDJSON streams shaped like Ollama's, with a configurable delay
+before the first token and a fixed token rate, so the app and the
+benchmarks can run without a GPU or network:
+
+    python benchmarks/fake_ollama.py --port 11500 --latency-ms 300 --tokens-per-second 40
+    GEMMA_API_URL=http://localhost:11500/api/generate streamlit run app.py
+
+It also answers GET /api/tags so health checks see it as up. To try
+failover across several servers, `--fail` (or `server.settings["fail"]`)
+makes one misbehave: "error" answers generations with a 500, "drop"
+closes the connection before the first token and "down" fails every
+request, health checks included.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "Thanks for sharing that with me. It sounds like you have a lot going on right now, "
+    "and it is completely okay to take things one step at a time. Would you like to talk "
+    "a bit more about what has been on your mind today?"
+)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.server.settings["fail"] == "down":
+            self.send_error(503)
+            return
+        if self.path.rstrip("/") != "/api/tags":
+            self.send_error(404)
+            return
+        body = json.dumps({"models": [{"name": "gemma:2b"}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/api/generate":
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        settings = self.server.settings
+        self.server.requests_served += 1
+        if settings["fail"] in ("error", "down"):
+            self.send_error(500 if settings["fail"] == "error" else 503)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if settings["fail"] == "drop":
+            # Headers went out, then the connection dies before any token
+            self.close_connection = True
+            return
+
+        started = time.perf_counter()
+        time.sleep(settings["latency_ms"] / 1000.0)
+        words = settings["reply"].split(" ")[:settings["reply_tokens"]]
+        interval = 1.0 / settings["tokens_per_second"] if settings["tokens_per_second"] else 0.0
+        try:
+            for index, word in enumerate(words):
+                token = word if index == 0 else " " + word
+                line = {"model": payload.get("model", "gemma:2b"), "response": token, "done": False}
+                self._send_chunk(json.dumps(line).encode("utf-8") + b"\n")
+                if interval:
+                    time.sleep(interval)
+
+            total_ns = int((time.perf_counter() - started) * 1e9)
+            final = {
+                "model": payload.get("model", "gemma:2b"),
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "context": list(payload.get("context") or []) + list(range(len(words))),
+                "total_duration": total_ns,
+                "prompt_eval_count": len(payload.get("prompt", "").split()),
+                "prompt_eval_duration": int(settings["latency_ms"] * 1e6),
+                "eval_count": len(words),
+                "eval_duration": int(len(words) * interval * 1e9),
+            }
+            self._send_chunk(json.dumps(final).encode("utf-8") + b"\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (cancelled generation)
+            self.server.requests_cancelled += 1
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is normal here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_fake_ollama(port=0, latency_ms=200, tokens_per_second=50, reply=DEFAULT_REPLY,
+                      reply_tokens=1000, host="127.0.0.1", fail=""):
+    """Serve in a background thread; returns (server, generate URL)"""
+    server = FakeOllamaServer((host, port), FakeOllamaHandler)
+    server.settings = {
+        "latency_ms": latency_ms,
+        "tokens_per_second": tokens_per_second,
+        "reply": reply,
+        "reply_tokens": reply_tokens,
+        "fail": fail,
+    }
+    server.requests_served = 0
+    server.requests_cancelled = 0
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/api/generate"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama /api/generate server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-ms", type=float, default=200, help="delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--reply-tokens", type=int, default=1000, help="cap on tokens per reply")
+    parser.add_argument("--fail", choices=["", "error", "drop", "down"], default="",
+                        help="misbehave to exercise failover")
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(args.port, args.latency_ms, args.tokens_per_second,
+                                    reply_tokens=args.reply_tokens, host=args.host, fail=args.fail)
+    print(f"Fake Ollama listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
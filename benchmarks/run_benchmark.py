@@ -0,0 +1,233 @@
+"""Benchmark and load test for the safety pipeline
+
+Drives check_mental_health and chatbot_pipeline from safety_pipeline.py
+with the labelled messages in corpus.jsonl at several concurrency levels
+and reports p50/p95/p99 latency, time to first token, classifier
+throughput and, per level, the RSS. Gemma is replaced by the local fake
+server in fake_ollama.py unless --ollama-url is given, so no GPU or
+network is needed:
+
+    python benchmarks/run_benchmark.py --concurrency 1 8 32 --json bench.json
+
+tracemalloc slows every allocation down (about 3x on the classifier
+level), so the timed levels run untraced. The Python allocation peak of
+each level comes from a separate, untimed pass over the corpus once the
+timings are done (--no-trace skips it).
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_ollama import start_fake_ollama  # noqa: E402
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """p50/p95/p99 of a list of seconds, in milliseconds"""
+    return {f"p{pct}": percentile(samples, pct) * 1000 for pct in (50, 95, 99)}
+
+
+def rss_mb():
+    """Resident set size now, from /proc on Linux (the process peak elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def with_rss(bench, *args):
+    """Run one timed concurrency level and add the resident size once it is done"""
+    row = bench(*args)
+    row["rss_mb"] = rss_mb()
+    return row
+
+
+def traced_peak_mb(bench, *args):
+    """Peak of the Python allocations made during one untimed run of a level, in MB"""
+    tracemalloc.start()
+    bench(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def run_concurrently(users, messages, work):
+    """Run `work(message)` over `messages` from `users` threads; returns wall seconds"""
+    pending = list(messages)
+    lock = threading.Lock()
+
+    def user_loop():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                message = pending.pop()
+            work(message)
+
+    threads = [threading.Thread(target=user_loop) for _ in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def bench_classifier(pipeline, classifier, corpus, users, rounds):
+    latencies = []
+    correct = []
+    lock = threading.Lock()
+
+    def work(item):
+        started = time.perf_counter()
+        label, _ = pipeline.check_mental_health(item["text"], classifier)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            correct.append(label.lower() == item["label"])
+
+    wall = run_concurrently(users, corpus * rounds, work)
+    result = {"users": users, "messages": len(latencies),
+              "throughput": len(latencies) / wall,
+              "accuracy_pct": 100.0 * sum(correct) / len(correct)}
+    result.update(summarize(latencies))
+    return result
+
+
+def bench_pipeline(pipeline, classifier, corpus, users, rounds):
+    totals, first_tokens, alerts, shed = [], [], [], []
+    lock = threading.Lock()
+
+    def work(item):
+        started = time.perf_counter()
+        reply, alert, _, _ = pipeline.chatbot_pipeline(item["text"], classifier, stream=True)
+        first_token = None
+        busy = False
+        if reply is not None:
+            for token in reply:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                busy = busy or token == pipeline.BUSY_MESSAGE
+        elapsed = time.perf_counter() - started
+        with lock:
+            totals.append(elapsed)
+            alerts.append(alert is not None)
+            shed.append(busy)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    wall = run_concurrently(users, corpus * rounds, work)
+    result = {"users": users, "messages": len(totals),
+              "throughput": len(totals) / wall,
+              "alerts": sum(alerts), "shed": sum(shed)}
+    result.update(summarize(totals))
+    result.update({f"ttft_{key}": value for key, value in summarize(first_tokens).items()})
+    return result
+
+
+def print_table(title, rows, columns):
+    print(f"\n{title}")
+    print("".join(f"{name:>12}" for name in columns))
+    for row in rows:
+        cells = []
+        for name in columns:
+            value = row.get(name, "-")
+            cells.append(f"{value:>12.1f}" if isinstance(value, float) else f"{value:>12}")
+        print("".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Safety pipeline benchmark")
+    parser.add_argument("--corpus", default=os.path.join(HERE, "corpus.jsonl"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the corpus per level")
+    parser.add_argument("--ollama-url", help="real Ollama endpoint instead of the fake server")
+    parser.add_argument("--latency-ms", type=float, default=200, help="fake server first-token delay")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="fake server token rate")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="fake server tokens per reply")
+    parser.add_argument("--with-cache", action="store_true", help="keep the classification and reply caches on")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="skip the traced pass that measures each level's Python allocation peak")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.ollama_url:
+        os.environ["GEMMA_API_URL"] = args.ollama_url
+    else:
+        server, url = start_fake_ollama(latency_ms=args.latency_ms,
+                                        tokens_per_second=args.tokens_per_second,
+                                        reply_tokens=args.reply_tokens)
+        os.environ["GEMMA_API_URL"] = url
+    if not args.with_cache:
+        os.environ["CLASSIFICATION_CACHE_SIZE"] = "0"
+        os.environ["REPLY_CACHE_SIZE"] = "0"
+    os.environ.setdefault("OLLAMA_POOL_SIZE", str(max(args.concurrency)))
+    # Set GENERATION_MAX_CONCURRENT yourself to measure queueing and shedding
+    os.environ.setdefault("GENERATION_MAX_CONCURRENT", str(max(args.concurrency)))
+
+    started = time.perf_counter()
+    import safety_pipeline as pipeline  # noqa: E402  (reads the environment set above)
+    classifier = pipeline.load_mental_health_classifier()
+    if classifier is None:
+        raise SystemExit("The mental health classifier could not be loaded")
+    startup = time.perf_counter() - started
+    startup_rss = rss_mb()
+
+    corpus = load_corpus(args.corpus)
+    classifier_rows = [with_rss(bench_classifier, pipeline, classifier, corpus, users, args.rounds)
+                       for users in args.concurrency]
+    pipeline_rows = [with_rss(bench_pipeline, pipeline, classifier, corpus, users, args.rounds)
+                     for users in args.concurrency]
+
+    if not args.no_trace:
+        # Separate pass, one round per level: the latencies above were measured untraced
+        for bench, rows in ((bench_classifier, classifier_rows), (bench_pipeline, pipeline_rows)):
+            for row in rows:
+                row["py_peak_mb"] = traced_peak_mb(bench, pipeline, classifier, corpus, row["users"], 1)
+
+    memory = {
+        "startup_s": startup,
+        "startup_rss_mb": startup_rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    print_table("Classifier (check_mental_health)", classifier_rows,
+                ["users", "messages", "throughput", "p50", "p95", "p99", "accuracy_pct",
+                 "py_peak_mb", "rss_mb"])
+    print_table("Pipeline (chatbot_pipeline, streamed)", pipeline_rows,
+                ["users", "messages", "throughput", "p50", "p95", "p99",
+                 "ttft_p50", "ttft_p95", "ttft_p99", "alerts", "shed", "py_peak_mb", "rss_mb"])
+    print(f"\nstartup {memory['startup_s']:.1f}s, RSS {memory['startup_rss_mb']:.0f} MB after startup, "
+          f"peak RSS {memory['peak_rss_mb']:.0f} MB over the run "
+          "(latencies in ms, throughput in messages/s, memory in MB; py_peak_mb from an untimed traced pass)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"classifier": classifier_rows, "pipeline": pipeline_rows,
+                       "memory": memory}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
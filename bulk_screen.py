@@ -0,0 +1,335 @@
+"""Bulk screening of archived messages with the mental health classifier
+
+Streams a JSONL or CSV archive batch by batch, classifies the batches on
+a pool of worker processes (each with its own copy of the classifier)
+and appends one result per message to the output as soon as its batch
+is done. Long messages are classified sentence by sentence like in the
+app, and `critical` uses the same rule, with the thresholds PipelineConfig
+reads (LABEL_THRESHOLDS_PATH included).
+
+After every written batch a checkpoint records how far the input was
+read, so an interrupted run continues where it stopped:
+
+    python bulk_screen.py archive.jsonl results.jsonl --workers 4
+    python bulk_screen.py archive.csv results.csv --text-field body --id-field message_id
+
+Run it again with the same arguments to resume; --restart starts over.
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"   # disables oneDNN messages
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"   # hides TensorFlow warnings/info
+
+from classifier_backends import load_classifier
+from pipeline_config import PipelineConfig
+from safety_rules import is_critical, pick_label
+from text_chunking import chunk_text, max_scores_per_label, needs_chunking
+
+logger = logging.getLogger("mindcare.bulk")
+
+OUTPUT_FIELDS = ["id", "label", "score", "critical"]
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def iter_lines(f, offset=0):
+    """Yield (line, end offset) from a binary file, starting at `offset`"""
+    f.seek(offset)
+    for raw in f:
+        # utf-8-sig drops the byte order mark some tools put at the start of the file
+        line = raw.decode("utf-8-sig" if offset == 0 else "utf-8", errors="replace")
+        offset += len(raw)
+        yield line, offset
+
+
+def iter_records(path, text_field="text", id_field=None, offset=0, on_malformed=None):
+    """Yield (record id, text, end offset) from a JSONL or CSV file
+
+    The end offset is the byte position right after the record, which is
+    what the checkpoint stores. Without an id field the id is the record
+    number in the file. A CSV without the text column, or a first JSONL
+    record without the text field, raises ValueError (a BOM or a typo in
+    --text-field would otherwise screen empty strings). Later lines that
+    are not JSON objects with the field are skipped and reported to
+    on_malformed(end offset, reason).
+    """
+    is_csv = path.lower().endswith(".csv")
+    with open(path, "rb") as f:
+        header = None
+        if is_csv:
+            raw = f.readline()
+            header = next(csv.reader([raw.decode("utf-8-sig")]), [])
+            if text_field not in header:
+                raise ValueError(f"no {text_field!r} column (columns: {', '.join(header)})")
+            offset = max(offset, len(raw))
+
+        lines = iter_lines(f, offset)
+        position = {"offset": offset}
+
+        def text_lines():
+            # csv.reader pulls one line at a time, so the offset after each
+            # row is exactly the end of that row (even for quoted newlines)
+            for line, end in lines:
+                position["offset"] = end
+                yield line
+
+        if is_csv:
+            rows = (dict(zip(header, row)) for row in csv.reader(text_lines()) if row)
+        else:
+            rows = parse_json_lines(text_lines(), text_field, position, on_malformed, first=offset == 0)
+
+        for record in rows:
+            record_id = record.get(id_field) if id_field else None
+            text = record.get(text_field)
+            yield record_id, "" if text is None else str(text), position["offset"]
+
+
+def parse_json_lines(lines, text_field, position, on_malformed=None, first=True):
+    """JSON objects with `text_field` from JSONL lines, skipping (and reporting) the others"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+            if text_field not in record:
+                raise KeyError(text_field)
+        except (ValueError, KeyError) as e:
+            reason = f"no {text_field!r} field" if isinstance(e, KeyError) else str(e)
+            if first:
+                raise ValueError(f"first record: {reason}") from e
+            if on_malformed is not None:
+                on_malformed(position["offset"], reason)
+            continue
+        first = False
+        yield record
+
+
+def iter_batches(records, batch_size):
+    """Group (id, text, offset) records into lists of at most batch_size"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def classify_texts(classifier, texts, batch_size=64, max_tokens=256, max_chunks=8, rule=None):
+    """[(label, score)] for each text, with the app's chunking and label choice (rule: see pick_label)"""
+    tokenizer = getattr(classifier, "tokenizer", None)
+    pieces, owners = [], []
+    for index, text in enumerate(texts):
+        chunks = [text]
+        # A token covers at least one character, so short texts skip the tokenizer
+        if len(text) > max_tokens and needs_chunking(text, tokenizer, max_tokens):
+            chunks = chunk_text(text, tokenizer, max_tokens, max_chunks)[0] or [text]
+        pieces.extend(chunks)
+        owners.extend([index] * len(chunks))
+
+    # One call for every chunk of the batch, with all label scores per chunk
+    outputs = classifier(pieces, top_k=None, truncation=True, batch_size=batch_size)
+    per_text = [[] for _ in texts]
+    for owner, output in zip(owners, outputs):
+        per_text[owner].append(output)
+    return [pick_label(max_scores_per_label(results), **(rule or {})) for results in per_text]
+
+
+def _init_worker(settings, token, options):
+    _worker["classifier"] = load_classifier(token=token, **settings)
+    _worker["options"] = options
+
+
+def _classify_in_worker(texts):
+    return classify_texts(_worker["classifier"], texts, **_worker["options"])
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, state):
+    """Replace the checkpoint atomically so a crash never leaves half a file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class ResultWriter:
+    """Appends results as JSONL or CSV (by file extension)"""
+
+    def __init__(self, path, truncate_to=None):
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "wb")
+        if truncate_to is not None:
+            # Drop anything written after the last checkpoint
+            self.file.truncate(truncate_to)
+        self.file.seek(0, os.SEEK_END)
+        self.is_csv = path.lower().endswith(".csv")
+        if self.is_csv and self.file.tell() == 0:
+            self._write_rows([OUTPUT_FIELDS])
+
+    def _write_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        self.file.write(buffer.getvalue().encode("utf-8"))
+
+    def write(self, results):
+        if self.is_csv:
+            self._write_rows([[result[field] for field in OUTPUT_FIELDS] for result in results])
+        else:
+            self.file.write("".join(json.dumps(result) + "\n" for result in results).encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def screen(args):
+    """Run the screening and return the final checkpoint state"""
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    state = None if args.restart else read_checkpoint(checkpoint_path)
+    if state is not None and state.get("input") != os.path.abspath(args.input):
+        raise SystemExit(f"{checkpoint_path} belongs to {state.get('input')}; use --restart")
+    if state is None:
+        state = {"input": os.path.abspath(args.input), "offset": 0, "records": 0,
+                 "critical": 0, "malformed": 0, "output_bytes": 0}
+        if os.path.exists(args.output):
+            os.remove(args.output)
+    else:
+        logger.info("Resuming after %d records", state["records"])
+
+    config = PipelineConfig.from_env()
+    settings = config.classifier_settings()
+    rule = config.alert_rule()
+    cpus = os.cpu_count() or 1
+    # Split the cores between workers so torch threads do not oversubscribe
+    settings["threads"] = args.threads or settings["threads"] or max(1, cpus // max(1, args.workers))
+    options = {"batch_size": args.model_batch_size, "max_tokens": args.chunk_max_tokens,
+               "max_chunks": args.chunk_budget, "rule": rule}
+    token = config.hf_token
+
+    def on_malformed(offset, reason):
+        state["malformed"] = state.get("malformed", 0) + 1
+        logger.warning("Skipped a malformed record ending at byte %d: %s", offset, reason)
+
+    records = iter_records(args.input, args.text_field, args.id_field, state["offset"], on_malformed)
+    batches = iter_batches(records, args.batch_size)
+    writer = ResultWriter(args.output, truncate_to=state["output_bytes"])
+
+    if args.workers > 0:
+        pool = ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                   initargs=(settings, token, options))
+        submit = lambda texts: pool.submit(_classify_in_worker, texts)  # noqa: E731
+    else:
+        pool = None
+        _init_worker(settings, token, options)
+        submit = None
+
+    started = time.perf_counter()
+    done_this_run = 0
+    last_report = started
+    # Bounded number of batches in flight keeps memory flat on huge archives
+    pending = deque()
+    max_pending = max(2, 2 * args.workers)
+    try:
+        while True:
+            while pool is not None and len(pending) < max_pending:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append((batch, submit([text for _, text, _ in batch])))
+
+            if pool is not None:
+                if not pending:
+                    break
+                batch, future = pending.popleft()
+                labels = future.result()
+            else:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                labels = _classify_in_worker([text for _, text, _ in batch])
+
+            results = []
+            for number, ((record_id, _, _), (label, score)) in enumerate(zip(batch, labels)):
+                critical = is_critical(label, score, **rule)
+                state["critical"] += critical
+                results.append({
+                    "id": record_id if record_id is not None else state["records"] + number,
+                    "label": label,
+                    "score": round(float(score), 6),
+                    "critical": critical,
+                })
+            state["output_bytes"] = writer.write(results)
+            state["records"] += len(batch)
+            state["offset"] = batch[-1][2]
+            write_checkpoint(checkpoint_path, state)
+            done_this_run += len(batch)
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                logger.info("%d records (%.1f msg/s), %d critical",
+                            state["records"], done_this_run / (now - started), state["critical"])
+                last_report = now
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    state["seconds"] = elapsed
+    state["throughput"] = done_this_run / elapsed if elapsed else 0.0
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen a message archive for crisis messages")
+    parser.add_argument("input", help="JSONL or CSV archive")
+    parser.add_argument("output", help="results file (.jsonl or .csv)")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--id-field", help="field copied to the output as the id (default: record number)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="classifier processes (0 = classify in this process)")
+    parser.add_argument("--threads", type=int, default=0, help="torch/onnx threads per worker")
+    parser.add_argument("--batch-size", type=int, default=512, help="messages per worker task")
+    parser.add_argument("--model-batch-size", type=int, default=64, help="messages per forward pass")
+    parser.add_argument("--chunk-max-tokens", type=int, default=int(os.getenv("CHUNK_MAX_TOKENS", "256")))
+    parser.add_argument("--chunk-budget", type=int, default=int(os.getenv("CHUNK_BUDGET", "8")))
+    parser.add_argument("--checkpoint", help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--report-every", type=float, default=10, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", stream=sys.stderr)
+    try:
+        state = screen(args)
+    except ValueError as e:
+        raise SystemExit(f"{args.input}: {e}")
+    print(f"{state['records']} records screened, {state['critical']} critical, "
+          f"{state.get('malformed', 0)} malformed skipped; "
+          f"{state['throughput']:.1f} msg/s this run ({state['seconds']:.1f}s including model load)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Calibrated multi-label scoring and per-label threshold fitting
+
+Keeping only the classifier's top label hides risk spread over several
+labels: a message scored 45% suicidal / 40% depression never reaches the
+0.7 THRESHOLD on either. ThresholdScorer takes the full score vector of
+every message (`top_k=None`), lays a batch out as one (messages, labels)
+matrix and applies the per-label thresholds it is given to the whole
+batch at once:
+
+    critical  = (scores > thresholds) & critical_label_mask
+    label     = the highest critical label where a row has one,
+                the top label otherwise
+
+which is the pick_label() rule, vectorized. The app uses it with
+CALIBRATED_SCORING=true and the thresholds PipelineConfig read from
+LABEL_THRESHOLDS_PATH (THRESHOLD for any label the file does not list).
+
+Thresholds are fitted on a labelled set. For each critical label the
+threshold is set so that --target-recall of the messages with that gold
+label score above it, and it is never raised above THRESHOLD:
+
+    python calibration.py fit labelled.csv --out label_thresholds.json --target-recall 0.9
+    python calibration.py report labelled.csv --thresholds label_thresholds.json
+
+The labelled file is a CSV or JSONL with a text and a label column
+(--text-field / --label-field). `report` prints alert recall and
+precision with THRESHOLD and with the fitted thresholds, overall and per
+label.
+"""
+
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from safety_rules import CRITICAL_LABELS, THRESHOLD, load_label_thresholds
+
+
+class ThresholdScorer:
+    """(label, score) decisions for batches of full score vectors, in one NumPy pass"""
+
+    def __init__(self, thresholds=None, default=THRESHOLD, critical_labels=CRITICAL_LABELS):
+        self.thresholds = thresholds or {}
+        self.default = default
+        self.critical_labels = {label.lower() for label in critical_labels}
+        # (labels, column by label, threshold row, critical mask), replaced as a whole
+        self._columns = None
+
+    @property
+    def labels(self):
+        return self._columns[0] if self._columns else ()
+
+    def _set_labels(self, labels):
+        lowered = [label.lower() for label in labels]
+        self._columns = (
+            labels,
+            {label: column for column, label in enumerate(labels)},
+            np.array([self.thresholds.get(label, self.default) for label in lowered]),
+            np.array([label in self.critical_labels for label in lowered]),
+        )
+
+    def score_matrix(self, outputs):
+        """(messages, labels) array from classifier(texts, top_k=None) outputs"""
+        seen = {result["label"] for results in outputs for result in results}
+        if self._columns is None or not seen.issubset(self._columns[1]):
+            # The classifier's label set is learnt from its first outputs
+            self._set_labels(sorted(seen.union(self.labels)))
+        columns = self._columns[1]
+
+        matrix = np.zeros((len(outputs), len(columns)))
+        for row, results in enumerate(outputs):
+            for result in results:
+                matrix[row, columns[result["label"]]] = result["score"]
+        return matrix
+
+    def decide(self, scores):
+        """(label column, score, critical) arrays for each row of a score matrix"""
+        _, _, thresholds, critical_mask = self._columns
+        critical = (scores > thresholds) & critical_mask
+        top_critical = np.where(critical, scores, -np.inf).argmax(axis=1)
+        alert = critical.any(axis=1)
+        chosen = np.where(alert, top_critical, scores.argmax(axis=1))
+        return chosen, scores[np.arange(len(scores)), chosen], alert
+
+    def pick(self, outputs):
+        """[(label, score)] for a batch of top_k=None classifier outputs"""
+        if not outputs:
+            return []
+        scores = self.score_matrix(outputs)
+        chosen, best, _ = self.decide(scores)
+        labels = self.labels
+        return [(labels[column], float(score)) for column, score in zip(chosen, best)]
+
+    def classify(self, classifier, texts, batch_size=32):
+        """[(label, score)] for each text, from one classifier call"""
+        outputs = classifier(list(texts), top_k=None, truncation=True, batch_size=batch_size)
+        return self.pick(outputs)
+
+
+def load_labelled(path, text_field="text", label_field="label"):
+    """(texts, lowercased gold labels) from a CSV or JSONL file"""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    records = [record for record in records if record.get(text_field) and record.get(label_field)]
+    return ([str(record[text_field]) for record in records],
+            [str(record[label_field]).strip().lower() for record in records])
+
+
+def fit_thresholds(scores, labels, gold, target_recall=0.9, min_threshold=0.05, max_threshold=THRESHOLD):
+    """{label: threshold} for the critical labels with examples in the gold set
+
+    Each threshold lets `target_recall` of that label's gold messages
+    score above it, clamped to [min_threshold, max_threshold]. Labels
+    without gold examples keep the default.
+    """
+    gold = np.asarray(gold)
+    thresholds = {}
+    for column, label in enumerate(labels):
+        label = label.lower()
+        if label not in CRITICAL_LABELS:
+            continue
+        positives = scores[gold == label, column]
+        if not len(positives):
+            continue
+        cutoff = np.quantile(positives, 1.0 - target_recall, method="lower")
+        # Alerts need score > threshold, so step just below the cutoff score
+        threshold = np.nextafter(cutoff, -np.inf)
+        thresholds[label] = round(float(np.clip(threshold, min_threshold, max_threshold)), 6)
+    return thresholds
+
+
+def alert_report(scorer, scores, gold):
+    """Alert recall and precision, overall and per gold critical label"""
+    _, _, alerts = scorer.decide(scores)
+    gold = np.asarray(gold)
+    crisis = np.isin(gold, CRITICAL_LABELS)
+
+    report = {"messages": len(gold), "alerts": int(alerts.sum()), "crisis": int(crisis.sum())}
+    report["recall"] = float(alerts[crisis].mean()) if crisis.any() else None
+    report["precision"] = float(crisis[alerts].mean()) if alerts.any() else None
+    report["labels"] = {
+        label: float(alerts[gold == label].mean())
+        for label in sorted(set(gold[crisis]))
+    }
+    return report
+
+
+def _load_transformer():
+    from classifier_backends import backend_settings_from_env, load_classifier
+    return load_classifier(token=os.getenv("HF_API_TOKEN"), **backend_settings_from_env())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit or evaluate per-label alert thresholds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fit = commands.add_parser("fit", help="fit per-label thresholds on a labelled set")
+    fit.add_argument("messages", help=".csv or .jsonl with a text and a label column")
+    fit.add_argument("--out", default="label_thresholds.json")
+    fit.add_argument("--target-recall", type=float, default=0.9)
+    fit.add_argument("--min-threshold", type=float, default=0.05)
+    fit.add_argument("--max-threshold", type=float, default=THRESHOLD)
+
+    report = commands.add_parser("report", help="alert recall / precision with THRESHOLD and fitted thresholds")
+    report.add_argument("messages", help=".csv or .jsonl with a text and a label column")
+    report.add_argument("--thresholds", default=os.getenv("LABEL_THRESHOLDS_PATH", ""))
+
+    for command in (fit, report):
+        command.add_argument("--text-field", default="text")
+        command.add_argument("--label-field", default="label")
+        command.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    texts, gold = load_labelled(args.messages, args.text_field, args.label_field)
+    if not texts:
+        raise SystemExit(f"No labelled messages in {args.messages}")
+    classifier = _load_transformer()
+    outputs = classifier(texts, top_k=None, truncation=True, batch_size=args.batch_size)
+
+    if args.command == "fit":
+        scorer = ThresholdScorer(thresholds={})
+        scores = scorer.score_matrix(outputs)
+        thresholds = fit_thresholds(scores, scorer.labels, gold, args.target_recall,
+                                    args.min_threshold, args.max_threshold)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"thresholds": thresholds, "target_recall": args.target_recall,
+                       "messages": len(texts)}, f, indent=2)
+        for label, threshold in sorted(thresholds.items()):
+            print(f"{label:>12}: {threshold:.4f} ({sum(g == label for g in gold)} examples)")
+        print(f"saved {args.out}")
+        return
+
+    fitted = load_label_thresholds(args.thresholds) if args.thresholds else {}
+    for name, thresholds in (("THRESHOLD", {}), ("calibrated", fitted)):
+        scorer = ThresholdScorer(thresholds=thresholds)
+        result = alert_report(scorer, scorer.score_matrix(outputs), gold)
+        recall = f"{result['recall']:.1%}" if result["recall"] is not None else "-"
+        precision = f"{result['precision']:.1%}" if result["precision"] is not None else "-"
+        per_label = ", ".join(f"{label} {value:.0%}" for label, value in result["labels"].items())
+        print(f"{name:>11}: {result['alerts']} alerts for {result['crisis']} crisis messages, "
+              f"recall {recall}, precision {precision} ({per_label})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Append-only chat log store on SQLite
+
+Each chat turn is written as one row as soon as it happens, instead of
+living only in a growing list in Streamlit session state. History is
+read back a page at a time, and exports stream row batches straight to
+a file, so neither rendering nor exporting needs the whole conversation
+in memory.
+
+Set CHAT_STORE_PATH to a file to keep the log across restarts (WAL
+mode, so readers never block the writer). Without it the log goes to a
+temporary file that is deleted when the process exits (path=None), so
+evicting idle sessions really moves them out of the process; ":memory:"
+keeps everything in process memory.
+
+The store also keeps the state of conversations that were evicted from
+memory while idle (rolling risk, Gemma context), one JSON row per
+session, until the session is used again (see session_manager.py).
+
+prune() deletes conversations with no new turn for a given time, turns
+and saved state alike; the session manager runs it with
+CHAT_RETENTION_SECONDS, so an in-memory or temporary log stays bounded.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def _remove_database(path):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+class ChatStore:
+    """Thread-safe append-only log of chat turns, grouped by session id"""
+
+    def __init__(self, path=":memory:"):
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(prefix="mindcare-chats-", suffix=".sqlite")
+            os.close(fd)
+            atexit.register(_remove_database, path)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "label TEXT, "
+            "record TEXT NOT NULL, "
+            "created REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_states ("
+            "session_id TEXT PRIMARY KEY, "
+            "state TEXT NOT NULL, "
+            "saved REAL)"
+        )
+        # Files written before retention existed lack the time columns
+        for table, column in (("turns", "created"), ("session_states", "saved")):
+            columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} REAL")
+        self._db.commit()
+
+    def append(self, session_id, entry):
+        """Write one chat entry and return it with its row id under 'id'"""
+        record = {key: value for key, value in entry.items() if key != "id"}
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO turns (session_id, label, record, created) VALUES (?, ?, ?, ?)",
+                (session_id, record.get("mental_health_label"), json.dumps(record), time.time()),
+            )
+            self._db.commit()
+        return dict(record, id=cursor.lastrowid)
+
+    def recent(self, session_id, limit=50, before_id=None):
+        """Up to `limit` entries before `before_id` (newest page by default), oldest first"""
+        query = "SELECT id, record FROM turns WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [dict(json.loads(record), id=row_id) for row_id, record in reversed(rows)]
+
+    def iter_entries(self, session_id, batch_size=200):
+        """Yield every entry of a session in order, reading one batch at a time"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, record FROM turns WHERE session_id = ? AND id > ? "
+                    "ORDER BY id LIMIT ?",
+                    (session_id, last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row_id, record in rows:
+                yield dict(json.loads(record), id=row_id)
+            last_id = rows[-1][0]
+
+    def export_json(self, session_id, fp):
+        """Stream a session to a text file as a JSON array"""
+        fp.write("[")
+        for index, entry in enumerate(self.iter_entries(session_id)):
+            entry.pop("id", None)
+            fp.write(",\n" if index else "\n")
+            fp.write(json.dumps(entry, indent=2))
+        fp.write("\n]\n")
+
+    def count(self, session_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def label_counts(self, session_id):
+        """{label: number of turns} for a session"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT label, COUNT(*) FROM turns WHERE session_id = ? GROUP BY label",
+                (session_id,),
+            ).fetchall()
+        return {label: count for label, count in rows if label is not None}
+
+    def clear(self, session_id):
+        """Delete every entry of a session"""
+        with self._lock:
+            self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM session_states WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def save_session_state(self, session_id, state):
+        """Keep a JSON-serializable state for a session, replacing any earlier one"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO session_states (session_id, state, saved) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time()),
+            )
+            self._db.commit()
+
+    def pop_session_state(self, session_id):
+        """The saved state of a session (removed from the store), None when there is none"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM session_states WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM session_states WHERE session_id = ?", (session_id,))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def prune(self, max_age, keep=()):
+        """Delete conversations whose newest turn is older than max_age seconds; returns how many
+
+        Sessions in `keep` (the ones still in memory) are left alone. Their
+        saved state goes with them, as does any state saved that long ago.
+        """
+        cutoff = time.time() - max_age
+        keep = list(keep)
+        exclude = f" AND session_id NOT IN ({','.join('?' * len(keep))})" if keep else ""
+        with self._lock:
+            sessions = [row[0] for row in self._db.execute(
+                "SELECT session_id FROM turns GROUP BY session_id "
+                f"HAVING MAX(COALESCE(created, 0)) < ?{exclude}", [cutoff] + keep
+            )]
+            self._db.executemany("DELETE FROM turns WHERE session_id = ?",
+                                 [(session_id,) for session_id in sessions])
+            self._db.execute(f"DELETE FROM session_states WHERE COALESCE(saved, 0) < ?{exclude}",
+                             [cutoff] + keep)
+            self._db.commit()
+        return len(sessions)
+
+    def size_bytes(self):
+        """Size of the database (freed pages are reused by later writes)"""
+        with self._lock:
+            pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        return pages * page_size
+
+    @property
+    def in_memory(self):
+        return self.path == ":memory:"
+
+    @property
+    def persistent(self):
+        """True when the log outlives the process"""
+        return not (self.in_memory or self.temporary)
@@ -0,0 +1,197 @@
+"""Inference backends for the mental health classifier
+
+The classifier can run on:
+
+    torch      the full-precision PyTorch pipeline (default)
+    onnx       the model exported to ONNX and run with ONNX Runtime
+    onnx-int8  the ONNX export with dynamic INT8 weight quantization
+
+Every backend returns a transformers text-classification pipeline, so
+callers use `classifier(text)` exactly as before. The ONNX backends need
+`pip install optimum[onnxruntime]`; the export is written once to
+ONNX_EXPORT_DIR and reused on later starts.
+
+Check that a backend agrees with PyTorch before switching to it:
+
+    python classifier_backends.py --backend onnx-int8 --tolerance 0.05
+"""
+
+import os
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"   # disables oneDNN messages
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"   # hides TensorFlow warnings/info
+
+MODEL_ID = "tahaenesaslanturk/mental-health-classification-v0.2"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Short sample used by the parity check when no text file is given
+PARITY_SAMPLES = [
+    "hi",
+    "thanks, that helps",
+    "I had a nice walk in the park today.",
+    "I can't stop worrying about my exams, my heart keeps racing.",
+    "Work has been overwhelming and I barely sleep anymore.",
+    "I feel empty and nothing I do seems to matter.",
+    "I don't want to be alive anymore.",
+    "Everyone would be better off without me.",
+]
+
+
+def backend_settings_from_env():
+    """Read CLASSIFIER_BACKEND / CLASSIFIER_MODEL_PATH / CLASSIFIER_THREADS / ONNX_EXPORT_DIR / CLASSIFIER_OFFLINE"""
+    return {
+        "backend": os.getenv("CLASSIFIER_BACKEND", "torch").lower(),
+        # A local snapshot directory loads without any hub lookups
+        "model_id": os.getenv("CLASSIFIER_MODEL_PATH") or MODEL_ID,
+        "threads": int(os.getenv("CLASSIFIER_THREADS", "0")) or None,
+        "export_dir": os.getenv("ONNX_EXPORT_DIR", "onnx_models"),
+        "offline": os.getenv("CLASSIFIER_OFFLINE", "false").lower() in ("1", "true", "yes"),
+    }
+
+
+def import_backend(backend="torch", model_id=MODEL_ID, offline=False):
+    """Import the heavy libraries for a backend
+
+    Loading from a local directory (or with offline=True) switches the
+    Hugging Face libraries to offline mode first, so startup never waits
+    on the hub.
+    """
+    if os.path.isdir(model_id) or offline:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    import transformers  # noqa: F401
+
+    if backend == "torch":
+        import torch  # noqa: F401
+        return
+
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX classifier backend needs optimum: pip install optimum[onnxruntime]"
+        ) from e
+
+
+def load_classifier(backend="torch", model_id=MODEL_ID, token=None, threads=None,
+                    export_dir="onnx_models", offline=False):
+    """Build a text-classification pipeline on the requested backend"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown classifier backend {backend!r}, expected one of {BACKENDS}")
+    import_backend(backend, model_id, offline)
+
+    if backend == "torch":
+        import torch
+        from transformers import pipeline
+
+        if threads:
+            torch.set_num_threads(threads)
+        return pipeline("text-classification", model=model_id, token=token)
+
+    return _load_onnx_classifier(model_id, token, threads, export_dir,
+                                 quantize=(backend == "onnx-int8"))
+
+
+def _export_dir_for(model_id, export_dir):
+    if os.path.isdir(model_id):
+        return os.path.join(export_dir, os.path.basename(os.path.normpath(model_id)))
+    return os.path.join(export_dir, model_id.replace("/", "--"))
+
+
+def export_onnx(model_id=MODEL_ID, token=None, export_dir="onnx_models", quantize=False):
+    """Export the model to ONNX (optionally INT8) and return (directory, file name)"""
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer
+
+    target = _export_dir_for(model_id, export_dir)
+    model_file = os.path.join(target, "model.onnx")
+    if not os.path.exists(model_file):
+        model = ORTModelForSequenceClassification.from_pretrained(model_id, export=True, token=token)
+        model.save_pretrained(target)
+        AutoTokenizer.from_pretrained(model_id, token=token).save_pretrained(target)
+
+    if not quantize:
+        return target, "model.onnx"
+
+    quantized_file = os.path.join(target, "model_quantized.onnx")
+    if not os.path.exists(quantized_file):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # Dynamic quantization: INT8 weights, activations quantized at run time
+        quantize_dynamic(model_file, quantized_file, weight_type=QuantType.QInt8)
+    return target, "model_quantized.onnx"
+
+
+def _load_onnx_classifier(model_id, token, threads, export_dir, quantize):
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer, pipeline
+
+    directory, file_name = export_onnx(model_id, token, export_dir, quantize)
+
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    model = ORTModelForSequenceClassification.from_pretrained(
+        directory, file_name=file_name, session_options=session_options
+    )
+    tokenizer = AutoTokenizer.from_pretrained(directory)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
+
+
+def check_parity(reference, candidate, texts, tolerance=0.05):
+    """Compare two classifiers and return the texts where they disagree
+
+    A text disagrees when the top label differs or the top score moves by
+    more than `tolerance`.
+    """
+    mismatches = []
+    for text, expected, actual in zip(texts, reference(texts), candidate(texts)):
+        if (expected["label"] != actual["label"]
+                or abs(expected["score"] - actual["score"]) > tolerance):
+            mismatches.append((text, expected, actual))
+    return mismatches
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Check a classifier backend against PyTorch")
+    parser.add_argument("--backend", choices=BACKENDS, default="onnx-int8")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--texts", help="file with one message per line")
+    args = parser.parse_args()
+
+    texts = PARITY_SAMPLES
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    token = os.getenv("HF_API_TOKEN")
+    settings = backend_settings_from_env()
+    reference = load_classifier("torch", settings["model_id"], token, args.threads,
+                                offline=settings["offline"])
+    candidate = load_classifier(args.backend, settings["model_id"], token, args.threads,
+                                settings["export_dir"], settings["offline"])
+
+    for name, classifier in (("torch", reference), (args.backend, candidate)):
+        classifier(texts[:1])  # warmup
+        started = time.perf_counter()
+        classifier(texts)
+        elapsed = (time.perf_counter() - started) * 1000 / len(texts)
+        print(f"{name:<10} {elapsed:8.1f} ms/message")
+
+    mismatches = check_parity(reference, candidate, texts, args.tolerance)
+    for text, expected, actual in mismatches:
+        print(f"MISMATCH {text!r}: torch {expected['label']} {expected['score']:.3f}, "
+              f"{args.backend} {actual['label']} {actual['score']:.3f}")
+    print(f"{len(texts) - len(mismatches)}/{len(texts)} messages within tolerance {args.tolerance}")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Shared micro-batching service for the mental health classifier
+
+Every Streamlit session calls the classifier with one message at a time.
+BatchingClassifier sits in front of a transformers text-classification
+pipeline, collects the messages coming from all sessions into small
+batches and runs one padded forward pass per batch on a background
+worker thread. It is called exactly like the pipeline it wraps.
+
+Run this file directly to measure throughput and latency at 1, 8 and 32
+concurrent users:
+
+    python classifier_service.py --max-batch-size 16 --max-wait-ms 10
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"   # disables oneDNN messages
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"   # hides TensorFlow warnings/info
+
+from classifier_backends import backend_settings_from_env, load_classifier
+
+
+class BatchingClassifier:
+    """Dynamic batching wrapper around a text-classification pipeline"""
+
+    _STOP = object()
+
+    def __init__(self, classifier, max_batch_size=16, max_wait_ms=10):
+        self.classifier = classifier
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.tokenizer = getattr(classifier, "tokenizer", None)
+        self.model = getattr(classifier, "model", None)
+        self.batches_run = 0
+        self.items_classified = 0
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="classifier-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def __call__(self, inputs, **kwargs):
+        """Classify a string or a list of strings, same return shape as the pipeline"""
+        single = isinstance(inputs, str)
+        texts = [inputs] if single else list(inputs)
+        futures = [self.submit(text, **kwargs) for text in texts]
+        results = [future.result() for future in futures]
+
+        if not single:
+            return results
+        # pipeline("text") returns [top] by default and the flat list with top_k
+        result = results[0]
+        return [result] if isinstance(result, dict) else result
+
+    def submit(self, text, **kwargs):
+        """Queue one text for classification and return a Future"""
+        future = Future()
+        self._requests.put((text, kwargs, future))
+        return future
+
+    def close(self):
+        """Stop the worker once the queued requests are done"""
+        self._requests.put(self._STOP)
+        self._worker.join()
+
+    def _collect_batch(self, first):
+        """Gather requests until the batch is full or the wait budget is spent"""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                self._requests.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._requests.get()
+            if first is self._STOP:
+                return
+            batch = self._collect_batch(first)
+
+            # Requests with different pipeline options cannot share a forward pass
+            groups = {}
+            for text, kwargs, future in batch:
+                key = tuple(sorted(kwargs.items()))
+                groups.setdefault(key, []).append((text, future))
+
+            for key, items in groups.items():
+                self._run_group(dict(key), items)
+
+    def _run_group(self, kwargs, items):
+        texts = [text for text, _ in items]
+        options = {"truncation": True, **kwargs, "batch_size": len(texts)}
+        try:
+            results = self.classifier(texts, **options)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.items_classified += len(items)
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(classifier, users, messages_per_user, text):
+    """Run `users` concurrent callers and return (throughput, p50, p95) in msg/s and ms"""
+    latencies = []
+    lock = threading.Lock()
+
+    def user_loop():
+        for _ in range(messages_per_user):
+            started = time.perf_counter()
+            classifier(text)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=user_loop) for _ in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return (
+        len(latencies) / wall,
+        _percentile(latencies, 50) * 1000,
+        _percentile(latencies, 95) * 1000,
+    )
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classifier batching load test")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--messages", type=int, default=20, help="messages per user")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    text = "I have been feeling really low and tired for the past few weeks."
+    base = load_classifier(token=os.getenv("HF_API_TOKEN"), **backend_settings_from_env())
+    batched = BatchingClassifier(base, args.max_batch_size, args.max_wait_ms)
+    base(text)  # warmup
+
+    print(f"{'mode':<10}{'users':>6}{'msg/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for users in args.users:
+        for name, classifier in (("direct", base), ("batched", batched)):
+            throughput, p50, p95 = measure(classifier, users, args.messages, text)
+            print(f"{name:<10}{users:>6}{throughput:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+    print(f"batches run: {batched.batches_run}, mean batch size: "
+          f"{batched.items_classified / max(1, batched.batches_run):.1f}")
+    batched.close()
+
+
+if __name__ == "__main__":
+    main()
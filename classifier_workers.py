@@ -0,0 +1,167 @@
+"""Classifier worker processes that share one copy of the model weights
+
+One PyTorch classifier in the Streamlit process keeps a many-core box
+mostly idle, and running several app replicas loads the weights once per
+replica. WorkerPoolClassifier loads the pipeline once, then forks worker
+processes from it: the children see the parent's weight tensors through
+copy-on-write pages, so N workers cost roughly one model in RAM. Calls
+are sent to the workers over a multiprocessing queue and the wrapper is
+called exactly like the pipeline it wraps.
+
+Fork must happen before the parent runs inference (the intra-op thread
+pools do not survive a fork), so the pool is created right after loading
+and the warmup runs through the workers. Each worker gets its own torch
+thread count so N workers x threads stays within the core count.
+
+The ONNX backends keep their runtime threads inside the session, which
+cannot be forked; with those each worker loads its own session instead.
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(classifier, load, threads, requests, results):
+    """Worker loop: classify requests until the None sentinel arrives"""
+    if classifier is None:
+        classifier = load()
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        request_id, inputs, kwargs = item
+        try:
+            results.put((request_id, classifier(inputs, **kwargs), None))
+        except Exception as e:
+            # Exceptions from the model are not always picklable
+            results.put((request_id, None, f"{type(e).__name__}: {e}"))
+
+
+class WorkerPoolClassifier:
+    """Dispatches pipeline calls to forked worker processes"""
+
+    def __init__(self, classifier=None, workers=2, threads=None, load=None):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("Classifier worker processes need the fork start method (Linux/macOS)")
+        context = multiprocessing.get_context("fork")
+
+        self.tokenizer = getattr(classifier, "tokenizer", None)
+        self.model = getattr(classifier, "model", None)
+        self.workers = workers
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # With fork the arguments are inherited, not pickled
+        self._processes = [
+            context.Process(
+                target=_worker_main,
+                args=(classifier, load, threads, self._requests, self._results),
+                name=f"classifier-worker-{index}",
+                daemon=True,
+            )
+            for index in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+
+        self._receiver = threading.Thread(target=self._receive, name="classifier-results", daemon=True)
+        self._receiver.start()
+
+    def __call__(self, inputs, **kwargs):
+        """Classify a string or a list of strings, same return shape as the pipeline"""
+        return self.submit(inputs, **kwargs).result()
+
+    def submit(self, inputs, **kwargs):
+        """Send one pipeline call to the next free worker and return a Future"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The classifier worker pool is closed")
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        self._requests.put((request_id, inputs, kwargs))
+        return future
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, result, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if self._closed:
+                    return
+                self._check_workers()
+                continue
+
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def _check_workers(self):
+        """Fail every waiting call once a worker has died (its request is lost)"""
+        dead = [process for process in self._processes if not process.is_alive()]
+        if not dead:
+            return
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        logger.error("Classifier worker %s exited with code %s", dead[0].name, dead[0].exitcode)
+        for future in pending.values():
+            future.set_exception(RuntimeError("A classifier worker process exited"))
+
+    def close(self):
+        """Stop the workers once the queued requests are done"""
+        with self._lock:
+            self._closed = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join()
+
+
+def create_worker_pool_classifier(classifier, backend="torch", load=None, workers=0, threads=0):
+    """Start `workers` worker processes with `threads` torch threads each (0 = cores / workers)
+
+    Returns the classifier unchanged when workers is 0 or the platform
+    cannot fork.
+    """
+    if workers <= 0:
+        return classifier
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+
+    shared = backend == "torch"
+    try:
+        pool = WorkerPoolClassifier(
+            classifier if shared else None, workers, threads,
+            load=None if shared else load,
+        )
+    except RuntimeError as e:
+        logger.warning("%s; classifying in the app process instead", e)
+        return classifier
+    if not shared:
+        # The workers loaded their own sessions; only the tokenizer is used here
+        pool.tokenizer = getattr(classifier, "tokenizer", None)
+    logger.info("Started %d classifier workers with %d threads each", workers, threads)
+    return pool
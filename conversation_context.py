@@ -0,0 +1,148 @@
+"""Bounded conversation memory for Gemma prompts
+
+Sending only the new message gives the bot no memory, and prepending the
+whole chat history makes Ollama re-process an ever longer prompt on every
+turn. ConversationContext keeps two things per conversation:
+
+- the `context` token array Ollama returns in the closing `done` chunk.
+  Passing it back with the next request (plus `keep_alive`, so the model
+  stays loaded) lets Ollama continue from its KV cache, and only the new
+  message has to be prefilled.
+- a rebuildable text form: the most recent turns that fit in the token
+  budget plus a running summary of the turns that no longer fit.
+
+While the Ollama context stays within the budget, each turn sends just
+the new message with the context. Once it grows past the budget (or is
+missing, e.g. after a restart) the prompt is rebuilt from the summary and
+the recent turns, which starts a fresh, shorter context.
+"""
+
+import re
+
+from text_chunking import split_sentences
+
+# Used when a turn is rebuilt as text; must match what the app sends
+TURN_TEMPLATE = "User: {user}\nAssistant: {reply}\n"
+PROMPT_TEMPLATE = "User: {user}\nAssistant:"
+
+
+def estimate_tokens(text):
+    """Rough token count for Gemma's tokenizer (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def extractive_summary(summary, turns, max_tokens):
+    """Fold evicted turns into the summary, keeping the newest lines within max_tokens
+
+    Each turn contributes the first sentence of the user's message, which
+    keeps what the user talked about without another model call.
+    """
+    lines = [line for line in summary.split("\n") if line] if summary else []
+    for user, _ in turns:
+        sentences = split_sentences(user)
+        if sentences:
+            lines.append("- The user said: " + re.sub(r"\s+", " ", sentences[0])[:200])
+
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ConversationContext:
+    """Prompt builder with a token budget and Ollama KV-cache reuse"""
+
+    def __init__(self, token_budget=1024, summary_tokens=200, keep_alive="10m",
+                 summarize=extractive_summary):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.keep_alive = keep_alive
+        self.summarize = summarize
+        self.turns = []          # (user, reply) that still fit in the budget
+        self.summary = ""
+        self.context = None      # token array from Ollama's last done chunk
+        self._pending = None
+
+    @classmethod
+    def from_history(cls, entries, **settings):
+        """Rebuild from stored chat entries (alerts had no reply and are skipped)"""
+        conversation = cls(**settings)
+        for entry in entries:
+            if entry.get("bot_response") and not entry.get("alert"):
+                conversation.turns.append((entry["user_input"], entry["bot_response"]))
+        conversation._fit_turns(0)
+        return conversation
+
+    def has_history(self):
+        """True once earlier turns (or their summary or Ollama context) shape the prompt"""
+        return bool(self.turns or self.summary or self.context or self._pending)
+
+    def prepare(self, user_text):
+        """(prompt, options) for the next /api/generate request"""
+        self._pending = user_text
+        prompt = PROMPT_TEMPLATE.format(user=user_text)
+        options = {"keep_alive": self.keep_alive} if self.keep_alive else {}
+
+        if self.context is not None and len(self.context) + estimate_tokens(prompt) <= self.token_budget:
+            # Ollama continues from its cached context; only this turn is new
+            options["context"] = self.context
+            return prompt, options
+
+        # Start a fresh context from the summary and the turns that fit
+        self.context = None
+        self._fit_turns(estimate_tokens(prompt))
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}\n\n")
+        parts.extend(TURN_TEMPLATE.format(user=user, reply=reply) for user, reply in self.turns)
+        parts.append(prompt)
+        return "".join(parts), options
+
+    def complete(self, reply, final=None):
+        """Record the finished reply and the context from Ollama's done chunk"""
+        if self._pending is None:
+            return
+        self.turns.append((self._pending, reply))
+        self._pending = None
+        context = (final or {}).get("context")
+        self.context = list(context) if context else None
+
+    def add_turn(self, user_text, reply):
+        """Record a turn Gemma did not generate (a cached reply)"""
+        self.turns.append((user_text, reply))
+        # Ollama's context does not hold this turn, so the next prompt is rebuilt from the turns
+        self.context = None
+
+    def discard(self):
+        """Forget the prepared turn: its reply was never shown"""
+        self._pending = None
+
+    def reset(self):
+        self.turns.clear()
+        self.summary = ""
+        self.context = None
+        self._pending = None
+
+    def state(self):
+        """JSON-serializable snapshot (turns, summary, Ollama context), for restore()"""
+        return {"turns": [list(turn) for turn in self.turns], "summary": self.summary, "context": self.context}
+
+    def restore(self, state):
+        self.turns = [tuple(turn) for turn in state["turns"]]
+        self.summary = state["summary"]
+        self.context = state["context"]
+        self._pending = None
+
+    def _fit_turns(self, reserved_tokens):
+        """Move the oldest turns into the summary until the rest fit the budget"""
+        available = self.token_budget - reserved_tokens - self.summary_tokens
+        used = sum(estimate_tokens(TURN_TEMPLATE.format(user=user, reply=reply))
+                   for user, reply in self.turns)
+        evicted = 0
+        while evicted < len(self.turns) and used > available:
+            user, reply = self.turns[evicted]
+            used -= estimate_tokens(TURN_TEMPLATE.format(user=user, reply=reply))
+            evicted += 1
+        if evicted:
+            # Only the newly evicted turns are summarized; earlier ones are already in
+            self.summary = self.summarize(self.summary, self.turns[:evicted], self.summary_tokens)
+            del self.turns[:evicted]
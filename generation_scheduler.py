@@ -0,0 +1,102 @@
+"""Admission control for Gemma generations
+
+Ollama works through a handful of generations at a time; everything else
+piles up inside it until every request hits its timeout together.
+GenerationScheduler keeps that queue on our side instead:
+
+- at most `max_concurrent` generations run at once (match Ollama's
+  OLLAMA_NUM_PARALLEL),
+- waiting requests are served first come, first served, except that
+  requests with a higher priority (users whose recent messages scored
+  high on the classifier) go ahead of normal ones,
+- a caller can follow its queue position while it waits,
+- when `max_queue` requests are already waiting, or a request waits
+  longer than its timeout, it is shed with SchedulerBusy so the app can
+  answer with a friendly message right away.
+"""
+
+import itertools
+import threading
+import time
+
+
+class SchedulerBusy(Exception):
+    """The generation queue is full or the wait timed out"""
+
+
+class GenerationScheduler:
+    """Bounded-concurrency priority FIFO shared by all sessions"""
+
+    def __init__(self, max_concurrent=2, max_queue=16):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.shed = 0
+        self.admitted = 0
+        self._active = 0
+        self._waiting = []  # [sort key, ...] in no particular order
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=0, timeout=None, on_wait=None, cancelled=None):
+        """Block until a generation slot is free
+
+        Returns True with the slot held, or False when the `cancelled`
+        event was set while waiting. `on_wait(position)` is called every
+        time the 1-based queue position changes. Raises SchedulerBusy
+        when the queue is full or `timeout` seconds pass.
+        """
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self.admitted += 1
+                return True
+            if len(self._waiting) >= self.max_queue:
+                self.shed += 1
+                raise SchedulerBusy(f"{len(self._waiting)} generations already waiting")
+
+            # Higher priority first, then arrival order
+            key = (-priority, next(self._sequence))
+            self._waiting.append(key)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    position = 1 + sum(1 for other in self._waiting if other < key)
+                    if position == 1 and self._active < self.max_concurrent:
+                        self._active += 1
+                        self.admitted += 1
+                        return True
+                    if cancelled is not None and cancelled.is_set():
+                        return False
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.shed += 1
+                        raise SchedulerBusy(f"waited {timeout:g}s for a generation slot")
+                    if on_wait is None or position == last_position:
+                        # Wake up now and then to notice cancellation
+                        self._cond.wait(0.5 if remaining is None else min(remaining, 0.5))
+                        continue
+                # Outside the lock: the callback may be slow (it writes to a client)
+                on_wait(position)
+                last_position = position
+        finally:
+            with self._cond:
+                self._waiting.remove(key)
+                self._cond.notify_all()
+
+    def release(self):
+        """Free a slot taken by acquire()"""
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Queue state for display"""
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "shed": self.shed,
+            }
@@ -0,0 +1,133 @@
+"""LRU + TTL caches keyed on normalized message text
+
+Short messages like "hi", "ok" or "I'm fine!" come in over and over.
+normalize_text() folds case, whitespace and punctuation so trivially
+different spellings share one cache entry, and TTLCache keeps results
+for a bounded number of entries and seconds. A TTLCache can also be
+backed by an SQLite file so it survives restarts.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Fold case, punctuation and whitespace: "  I'm   FINE!! " -> "im fine" """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    kept = [ch for ch in text if not unicodedata.category(ch).startswith("P")]
+    return " ".join("".join(kept).split())
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds
+
+    With `path` set, entries are also written to an SQLite table and
+    looked up there on a memory miss, so they survive restarts. Values
+    must be JSON serializable when persisting.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None, table="cache", max_disk_entries=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries or maxsize * 10
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._table = table
+        self._writes = 0
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._prune_db()
+
+    def _prune_db(self):
+        """Drop expired rows and keep the table under max_disk_entries"""
+        self._db.execute(f"DELETE FROM {self._table} WHERE stored_at < ?",
+                         (time.time() - self.ttl,))
+        self._db.execute(
+            f"DELETE FROM {self._table} WHERE key NOT IN "
+            f"(SELECT key FROM {self._table} ORDER BY stored_at DESC LIMIT ?)",
+            (self.max_disk_entries,),
+        )
+        self._db.commit()
+
+    def get(self, key, default=None):
+        """Return the cached value or `default`, counting a hit or a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, stored_at FROM {self._table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the least recently used entry"""
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._prune_db()
+
+    def _store(self, key, value, stored_at):
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self._table}")
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters for display"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
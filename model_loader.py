@@ -0,0 +1,87 @@
+"""Background model loading with warmup and startup timings
+
+Importing transformers/torch and building the classifier takes tens of
+seconds, and the first inference pays tokenizer and kernel warmup on
+top. ModelLoader does all of that on a background thread so the UI (or
+the CLI prompt) is up immediately, and records how long each phase
+took:
+
+    loader = ModelLoader(load=build_classifier, imports=import_libraries).start()
+    ...
+    classifier = loader.wait()
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("mindcare.startup")
+
+WARMUP_TEXT = "Hello, how are you today?"
+
+
+class ModelLoader:
+    """Load a model on a background thread, then warm it up with one call"""
+
+    def __init__(self, load, imports=None, warmup_text=WARMUP_TEXT, name="classifier"):
+        self.name = name
+        self.status = "pending"
+        self.model = None
+        self.error = None
+        self.timings = {}
+        self._load = load
+        self._imports = imports
+        self._warmup_text = warmup_text
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start loading in the background and return self"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=f"{self.name}-loader", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _phase(self, status, key, func):
+        self.status = status
+        started = time.perf_counter()
+        result = func()
+        self.timings[key] = time.perf_counter() - started
+        return result
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            if self._imports is not None:
+                self._phase("importing", "import", self._imports)
+            model = self._phase("loading", "load", self._load)
+            if self._warmup_text:
+                self._phase("warming up", "warmup", lambda: model(self._warmup_text))
+            self.model = model
+            self.status = "ready"
+        except Exception as e:
+            self.error = e
+            self.status = "failed"
+            logger.exception("%s failed to load", self.name)
+        finally:
+            self.timings["total"] = time.perf_counter() - started
+            self._done.set()
+            logger.info("%s %s: %s", self.name, self.status, self.describe_timings())
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def wait(self, timeout=None):
+        """Block until loading finishes and return the model (None on failure)"""
+        self.start()
+        self._done.wait(timeout)
+        return self.model
+
+    def describe_timings(self):
+        """Startup breakdown such as "import 4.1s · load 6.3s · warmup 0.5s" """
+        phases = [(key, self.timings[key]) for key in ("import", "load", "warmup", "total")
+                  if key in self.timings]
+        return " · ".join(f"{key} {seconds:.1f}s" for key, seconds in phases)
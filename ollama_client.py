@@ -0,0 +1,399 @@
+"""Pooled, keep-alive HTTP client for the Ollama /api/generate endpoint
+
+OllamaClient keeps one requests.Session with a connection pool, so
+messages reuse warm TCP connections instead of opening a new one per
+request. Timeouts are split into connect, first-token and total, and
+connection resets before the reply starts are retried. The NDJSON
+reply is decoded chunk by chunk with ndjson_stream.GenerationDecoder.
+
+AsyncOllamaClient is the same thing on httpx for asyncio callers
+(`pip install httpx`).
+
+OllamaPool spreads generations over several Ollama instances
+(GEMMA_API_URLS, comma separated): each request goes to the healthy
+backend with the fewest requests in flight, a stream that fails before
+its first token is retried on the next backend, and a background thread
+checks every backend's /api/tags. PipelineConfig.build_client() returns
+a pool when GEMMA_API_URLS lists more than one URL and a plain
+OllamaClient otherwise.
+
+The settings are read from the environment into PipelineConfig (see
+`client_settings_from_env`):
+
+    GEMMA_API_URL=http://localhost:11434/api/generate
+    GEMMA_API_URLS=http://box1:11434/api/generate,http://box2:11434/api/generate
+    OLLAMA_HEALTH_INTERVAL=10
+    OLLAMA_POOL_SIZE=10
+    OLLAMA_CONNECT_TIMEOUT=5
+    OLLAMA_FIRST_TOKEN_TIMEOUT=60
+    OLLAMA_TOTAL_TIMEOUT=300
+    OLLAMA_RETRIES=2
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ndjson_stream import GenerationDecoder
+
+DEFAULT_MODEL = "gemma:2b"
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationTimeout(requests.exceptions.Timeout):
+    """The reply took longer than the total timeout"""
+
+
+def client_settings_from_env():
+    """Read the client settings from environment variables"""
+    return {
+        "url": os.getenv("GEMMA_API_URL"),
+        "model": os.getenv("GEMMA_MODEL", DEFAULT_MODEL),
+        "pool_size": int(os.getenv("OLLAMA_POOL_SIZE", "10")),
+        "connect_timeout": float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5")),
+        "first_token_timeout": float(os.getenv("OLLAMA_FIRST_TOKEN_TIMEOUT", "60")),
+        "total_timeout": float(os.getenv("OLLAMA_TOTAL_TIMEOUT", "300")),
+        "retries": int(os.getenv("OLLAMA_RETRIES", "2")),
+    }
+
+
+def backend_urls_from_env():
+    """Backend URLs from GEMMA_API_URLS (comma separated), or an empty list"""
+    return [url.strip() for url in os.getenv("GEMMA_API_URLS", "").split(",") if url.strip()]
+
+
+def build_payload(model, prompt, options):
+    """Request body for a streamed /api/generate call"""
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    payload.update(options)
+    return payload
+
+
+class GenerationStream:
+    """Iterator over the reply tokens of one streamed generation
+
+    After the stream ends, `final` holds the closing chunk from Ollama
+    (done_reason, eval counts, context). Closing the stream closes the
+    HTTP response, which makes Ollama stop generating.
+    """
+
+    def __init__(self, response, total_timeout):
+        self.response = response
+        self.decoder = GenerationDecoder()
+        self._deadline = time.monotonic() + total_timeout
+        self._closed = False
+
+    @property
+    def final(self):
+        return self.decoder.final
+
+    def __iter__(self):
+        try:
+            # chunk_size=None hands over each network read as it arrives
+            for chunk in self.response.iter_content(chunk_size=None):
+                if self._closed:
+                    return
+                if time.monotonic() > self._deadline:
+                    raise GenerationTimeout("Gemma reply exceeded the total timeout")
+                yield from self.decoder.feed(chunk)
+                if self.decoder.done:
+                    return
+            yield from self.decoder.finish()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop reading and release the connection"""
+        if not self._closed:
+            self._closed = True
+            self.response.close()
+
+
+class OllamaClient:
+    """Blocking Ollama client shared across threads and sessions"""
+
+    def __init__(self, url, model=DEFAULT_MODEL, pool_size=10, connect_timeout=5.0,
+                 first_token_timeout=60.0, total_timeout=300.0, retries=2):
+        self.url = url
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.total_timeout = total_timeout
+        self.retries = retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def open_stream(self, prompt, **options):
+        """Start a streamed generation and return a GenerationStream"""
+        payload = build_payload(self.model, prompt, options)
+        # The read timeout covers the wait for the first chunk; later reads
+        # are bounded by the total timeout checked while streaming
+        timeout = (self.connect_timeout, self.first_token_timeout)
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, json=payload, stream=True, timeout=timeout)
+                response.raise_for_status()
+                return GenerationStream(response, self.total_timeout)
+            except requests.exceptions.ConnectionError:
+                # Covers resets on a stale keep-alive connection; nothing
+                # has been generated yet so the request is safe to resend
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.2 * (attempt + 1))
+
+    def generate(self, prompt, **options):
+        """Return the full reply text for a prompt"""
+        return "".join(self.open_stream(prompt, **options))
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncOllamaClient:
+    """asyncio Ollama client on a pooled httpx.AsyncClient"""
+
+    def __init__(self, url, model=DEFAULT_MODEL, pool_size=10, connect_timeout=5.0,
+                 first_token_timeout=60.0, total_timeout=300.0, retries=2):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("AsyncOllamaClient needs httpx: pip install httpx") from e
+
+        self._httpx = httpx
+        self.url = url
+        self.model = model
+        self.total_timeout = total_timeout
+        self.retries = retries
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(first_token_timeout, connect=connect_timeout),
+        )
+
+    async def stream_tokens(self, prompt, **options):
+        """Async generator over the reply tokens"""
+        payload = build_payload(self.model, prompt, options)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+
+        started = False
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.client.stream("POST", self.url, json=payload) as response:
+                    response.raise_for_status()
+                    decoder = GenerationDecoder()
+                    async for chunk in response.aiter_bytes():
+                        if loop.time() > deadline:
+                            raise GenerationTimeout("Gemma reply exceeded the total timeout")
+                        for token in decoder.feed(chunk):
+                            started = True
+                            yield token
+                        if decoder.done:
+                            return
+                    for token in decoder.finish():
+                        yield token
+                return
+            except (self._httpx.ConnectError, self._httpx.RemoteProtocolError):
+                # Only retry when the connection failed before the reply started
+                if started or attempt == self.retries:
+                    raise
+                await asyncio.sleep(0.2 * (attempt + 1))
+
+    async def generate(self, prompt, **options):
+        """Return the full reply text for a prompt"""
+        return "".join([token async for token in self.stream_tokens(prompt, **options)])
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class Backend:
+    """One Ollama instance in a pool, with its load and latency numbers"""
+
+    def __init__(self, client):
+        self.client = client
+        self.url = client.url
+        self.health_url = urljoin(client.url, "/api/tags")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.first_token_latencies = deque(maxlen=200)
+        self.total_latencies = deque(maxlen=200)
+
+    def stats(self):
+        first_tokens = sorted(self.first_token_latencies)
+        totals = list(self.total_latencies)
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ttft_p50": first_tokens[len(first_tokens) // 2] if first_tokens else None,
+            "ttft_p95": first_tokens[int(len(first_tokens) * 0.95)] if first_tokens else None,
+            "total_mean": sum(totals) / len(totals) if totals else None,
+        }
+
+
+class PooledStream:
+    """GenerationStream that fails over to another backend before the first token"""
+
+    def __init__(self, pool, prompt, options):
+        self.final = None
+        self._pool = pool
+        self._prompt = prompt
+        self._options = options
+        self._tried = set()
+        self._closed = False
+        self._backend = None
+        self._stream = None
+        self._started_at = None
+        self._release_lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """Open the stream on the best untried backend, failing over on errors"""
+        while True:
+            backend = self._pool._checkout(self._tried)
+            if backend is None:
+                raise requests.exceptions.ConnectionError("No Ollama backend could start the reply")
+            self._tried.add(backend)
+            self._started_at = time.perf_counter()
+            try:
+                self._stream = backend.client.open_stream(self._prompt, **self._options)
+                self._backend = backend
+                backend.healthy = True
+                if self._closed:
+                    # close() ran while we were connecting
+                    self._release()
+                return
+            except requests.exceptions.RequestException as e:
+                self._pool._checkin(backend, error=e)
+                if len(self._tried) >= len(self._pool.backends):
+                    raise
+
+    def __iter__(self):
+        started = False
+        try:
+            while not self._closed:
+                backend, stream = self._backend, self._stream
+                try:
+                    for token in stream:
+                        if not started:
+                            started = True
+                            self._pool._record(backend.first_token_latencies,
+                                               time.perf_counter() - self._started_at)
+                        yield token
+                    self.final = stream.final
+                    self._pool._record(backend.total_latencies, time.perf_counter() - self._started_at)
+                    return
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    self._release(error=None if self._closed else e)
+                    # After the first token the reply cannot be resent without duplicating text
+                    if started or self._closed or len(self._tried) >= len(self._pool.backends):
+                        raise
+                    logger.warning("Ollama backend %s failed before the first token: %s", backend.url, e)
+                    self._open()
+        finally:
+            self.close()
+
+    def _release(self, error=None):
+        with self._release_lock:
+            backend, self._backend = self._backend, None
+            if self._stream is not None:
+                self._stream.close()
+            if backend is not None:
+                self._pool._checkin(backend, error=error)
+
+    def close(self):
+        """Stop reading and release the connection (safe from another thread)"""
+        if not self._closed:
+            self._closed = True
+            self._release()
+
+
+class OllamaPool:
+    """Least-outstanding-requests routing over several Ollama instances"""
+
+    def __init__(self, urls, model=DEFAULT_MODEL, health_interval=10.0, **client_settings):
+        if not urls:
+            raise ValueError("OllamaPool needs at least one backend URL")
+        self.model = model
+        self.url = urls[0]
+        self.backends = [Backend(OllamaClient(url, model=model, **client_settings)) for url in urls]
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if health_interval > 0:
+            threading.Thread(target=self._health_loop, name="ollama-health", daemon=True).start()
+
+    def _checkout(self, exclude=()):
+        """Reserve the healthy backend with the fewest requests in flight"""
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend not in exclude]
+            if not candidates:
+                return None
+            # Unhealthy backends are only tried when nothing healthy is left
+            backend = min(candidates, key=lambda b: (not b.healthy, b.outstanding, b.failures))
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def _checkin(self, backend, error=None):
+        with self._lock:
+            backend.outstanding -= 1
+            if error is not None:
+                backend.failures += 1
+                backend.healthy = False
+
+    def _record(self, samples, value):
+        with self._lock:
+            samples.append(value)
+
+    def open_stream(self, prompt, **options):
+        """Start a streamed generation on the least busy backend"""
+        return PooledStream(self, prompt, options)
+
+    def generate(self, prompt, **options):
+        """Return the full reply text for a prompt"""
+        return "".join(self.open_stream(prompt, **options))
+
+    def check_health(self):
+        """Probe every backend's /api/tags once"""
+        for backend in self.backends:
+            try:
+                response = backend.client.session.get(
+                    backend.health_url, timeout=backend.client.connect_timeout
+                )
+                healthy = response.ok
+            except requests.exceptions.RequestException:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.info("Ollama backend %s is %s", backend.url, "up" if healthy else "down")
+            backend.healthy = healthy
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def stats(self):
+        """Per-backend load, health and latency"""
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+    def close(self):
+        self._stop.set()
+        for backend in self.backends:
+            backend.client.close()
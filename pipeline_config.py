@@ -0,0 +1,211 @@
+"""Typed settings for the whole safety pipeline
+
+PipelineConfig gathers what used to be read separately by every entry
+point and module global (model id, backend, threads and worker processes,
+the alert thresholds, the pre-filter, caches, chunking, the generation
+queue, conversation memory, sessions, Ollama endpoints and timeouts) into
+one frozen object. safety_pipeline builds it once at
+import, after .env is loaded, and every model, client, cache and queue it
+hands out is built from it:
+
+    from safety_pipeline import CONFIG
+    CONFIG.model_id, CONFIG.gemma_urls, CONFIG.reply_cache_size, CONFIG.generation_max_concurrent
+
+Most fields are read from the environment variable of the same name in
+upper case (reply_cache_size from REPLY_CACHE_SIZE), parsed like the
+field's default; the classifier and Ollama ones keep their own variable
+names (CLASSIFIER_*, GEMMA_*, OLLAMA_*). The alert rule is applied by
+safety_rules with the thresholds held here: THRESHOLD and CRITICAL_LABELS
+by default, plus the per-label thresholds read once from
+LABEL_THRESHOLDS_PATH. Fields are hashable (tuples rather than lists or
+dicts), so a config can be a cache key.
+"""
+
+import os
+from dataclasses import dataclass, field, fields
+from typing import Optional, Tuple
+
+from classifier_backends import backend_settings_from_env
+from ollama_client import (
+    DEFAULT_MODEL, OllamaClient, OllamaPool, backend_urls_from_env, client_settings_from_env
+)
+from safety_rules import CRITICAL_LABELS, THRESHOLD, load_label_thresholds
+
+
+def _from_env(name, default):
+    """Environment variable `name` parsed like `default`, or the default when unset"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes")
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+    return value
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    # Classifier
+    model_id: str
+    backend: str = "torch"
+    threads: Optional[int] = None
+    export_dir: str = "onnx_models"
+    hf_token: Optional[str] = field(default=None, repr=False)
+    # Hugging Face offline mode even for a hub model id (a local directory always loads offline)
+    classifier_offline: bool = False
+    # Batch classifier calls from all sessions on one background worker
+    classifier_batching: bool = False
+    classifier_max_batch_size: int = 16
+    classifier_max_wait_ms: float = 10.0
+    # Worker processes sharing one copy of the weights (0 = in-process), torch threads each (0 = cores / workers)
+    classifier_workers: int = 0
+    classifier_worker_threads: int = 0
+    # Crisis lexicon + hashed n-gram model in front of the classifier (see prefilter.py)
+    prefilter: bool = False
+    prefilter_model_path: str = ""
+    prefilter_benign_max_chars: int = 80
+    prefilter_benign_threshold: float = 0.05
+
+    # Alert rule (applied by safety_rules); label_thresholds are (label, threshold)
+    # pairs from label_thresholds_path, used for the labels they list
+    threshold: float = THRESHOLD
+    critical_labels: Tuple[str, ...] = tuple(CRITICAL_LABELS)
+    label_thresholds_path: str = ""
+    label_thresholds: Tuple[Tuple[str, float], ...] = ()
+    # Score every label (top_k=None) against the per-label thresholds instead of the top label only
+    calibrated_scoring: bool = False
+    # Long messages are classified sentence by sentence, within a chunk budget
+    chunked_classification: bool = True
+    chunk_max_tokens: int = 256
+    chunk_budget: int = 8
+    # Classifier results for repeated short messages ("hi", "ok", "thanks")
+    classification_cache_size: int = 1024
+    classification_cache_ttl: float = 3600.0
+    classification_cache_path: str = ""
+
+    # Conversation-level risk: alert when the rolling score stays high across turns
+    sustained_risk_decay: float = 0.6
+    sustained_risk_threshold: float = 0.5
+
+    # Gemma / Ollama
+    gemma_urls: Tuple[str, ...] = ()
+    gemma_model: str = DEFAULT_MODEL
+    pool_size: int = 10
+    connect_timeout: float = 5.0
+    first_token_timeout: float = 60.0
+    total_timeout: float = 300.0
+    retries: int = 2
+    health_interval: float = 10.0
+    # Start Gemma while the classifier runs; the request is aborted for critical messages
+    speculative_generation: bool = False
+    # Conversation memory for Gemma: prompt token budget (0 = no memory) and model keep-alive
+    context_token_budget: int = 1024
+    context_summary_tokens: int = 200
+    ollama_keep_alive: str = "10m"
+    # Admission control: generations at once (match OLLAMA_NUM_PARALLEL), queue length, wait limit
+    generation_max_concurrent: int = 2
+    generation_max_queue: int = 16
+    generation_queue_timeout: float = 120.0
+    # Users whose rolling risk is at least this are served ahead of the queue
+    generation_priority_risk: float = 0.3
+    # Cached Gemma replies for repeated short non-critical messages ("hi", "thanks")
+    reply_cache_size: int = 512
+    reply_cache_ttl: float = 3600.0
+    reply_cache_path: str = ""
+    reply_cache_max_chars: int = 60
+    reply_cache_semantic: bool = False
+    reply_cache_similarity: float = 0.9
+
+    # Chat log: a file path keeps it across restarts, "" a temporary file, ":memory:" the process
+    chat_store_path: str = ""
+    chat_history_page_size: int = 50
+    # Conversations with no new turn for this long are deleted from the log (0 = keep);
+    # None: a day for a temporary or in-memory log, kept in a CHAT_STORE_PATH file
+    chat_retention_seconds: Optional[float] = None
+    # Per-conversation memory: cap in KB (0 = page size only) and idle time before eviction (0 = never)
+    session_memory_cap_kb: int = 256
+    session_idle_seconds: float = 900.0
+
+    @classmethod
+    def from_env(cls):
+        """Read the pipeline's environment variables (see the readme's "Optional settings")"""
+        classifier = backend_settings_from_env()
+        client = client_settings_from_env()
+        urls = backend_urls_from_env() or ([client["url"]] if client["url"] else [])
+        settings = {
+            "model_id": classifier["model_id"],
+            "backend": classifier["backend"],
+            "threads": classifier["threads"],
+            "export_dir": classifier["export_dir"],
+            "classifier_offline": classifier["offline"],
+            "hf_token": os.getenv("HF_API_TOKEN"),
+            "gemma_urls": tuple(urls),
+            "gemma_model": client["model"],
+            "pool_size": client["pool_size"],
+            "connect_timeout": client["connect_timeout"],
+            "first_token_timeout": client["first_token_timeout"],
+            "total_timeout": client["total_timeout"],
+            "retries": client["retries"],
+            "health_interval": float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10")),
+            # The rule's defaults live in safety_rules; only the calibration file is configurable
+            "threshold": THRESHOLD,
+            "critical_labels": tuple(CRITICAL_LABELS),
+        }
+        path = os.getenv("LABEL_THRESHOLDS_PATH", "")
+        if path:
+            settings["label_thresholds"] = tuple(sorted(load_label_thresholds(path).items()))
+        if os.getenv("CHAT_RETENTION_SECONDS"):
+            settings["chat_retention_seconds"] = float(os.getenv("CHAT_RETENTION_SECONDS"))
+        for setting in fields(cls):
+            if setting.name not in settings:
+                settings[setting.name] = _from_env(setting.name.upper(), setting.default)
+        return cls(**settings)
+
+    @property
+    def chat_retention(self):
+        """Seconds a conversation is kept in the chat log after its last turn (0 = forever)"""
+        if self.chat_retention_seconds is not None:
+            return self.chat_retention_seconds
+        return 0.0 if self.chat_store_path not in ("", ":memory:") else 86400.0
+
+    @property
+    def gemma_url(self):
+        """First Gemma endpoint, None when Gemma is not configured"""
+        return self.gemma_urls[0] if self.gemma_urls else None
+
+    def classifier_settings(self):
+        """Keyword arguments for classifier_backends.load_classifier (without the token)"""
+        return {
+            "backend": self.backend,
+            "model_id": self.model_id,
+            "threads": self.threads,
+            "export_dir": self.export_dir,
+            "offline": self.classifier_offline,
+        }
+
+    def alert_rule(self):
+        """Keyword arguments for safety_rules.is_critical and pick_label"""
+        return {
+            "thresholds": dict(self.label_thresholds),
+            "default": self.threshold,
+            "critical_labels": self.critical_labels,
+        }
+
+    def client_settings(self):
+        """Keyword arguments shared by OllamaClient and OllamaPool"""
+        return {
+            "model": self.gemma_model,
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "first_token_timeout": self.first_token_timeout,
+            "total_timeout": self.total_timeout,
+            "retries": self.retries,
+        }
+
+    def build_client(self):
+        """OllamaPool for several endpoints, else an OllamaClient"""
+        if len(self.gemma_urls) > 1:
+            return OllamaPool(list(self.gemma_urls), health_interval=self.health_interval,
+                              **self.client_settings())
+        return OllamaClient(self.gemma_url, **self.client_settings())
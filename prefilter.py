@@ -0,0 +1,313 @@
+"""Cheap first tier in front of the transformer classifier
+
+Most messages ("hi", "ok thanks") are obviously fine and do not need a
+transformer forward pass; a few state crisis intent so plainly that they
+must raise the alert whatever the classifier makes of them.
+PreFilter.screen() spots those two cases in microseconds and returns None
+for everything else:
+
+    escalate  a phrase from CRISIS_LEXICON appears in the message (one
+              pass of an Aho-Corasick automaton over the text); the
+              classifier still scores it, and the alert is raised even
+              when that score stays under the threshold
+    benign    a short message whose risk from a linear model on hashed
+              word n-grams is below the benign threshold; the classifier
+              is skipped
+
+The lexicon only holds first-person statements of intent. Words like
+"suicide" or "cut myself" also turn up in "an essay on suicide
+prevention" or "I cut myself shaving lol", so they are left to the
+classifier. An escalation has no score of its own, so the alert and the
+rolling risk use the classifier's.
+
+The linear model is trained offline, by default on the transformer's own
+decisions for a file of messages, and saved as a small .npz:
+
+    python prefilter.py train messages.jsonl --out prefilter_model.npz
+    python prefilter.py report benchmarks/corpus.jsonl --model prefilter_model.npz
+
+`report` runs both tiers on a labelled set and prints how many crisis
+messages the pre-filter would have let through (its recall), against the
+gold labels and against the transformer. Without a model file only the
+lexicon is used, so nothing is ever routed around the classifier as
+benign.
+"""
+
+import argparse
+import json
+import os
+import re
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from safety_rules import CRITICAL_LABELS, is_critical
+
+# First-person statements of intent only, matched on word boundaries after
+# normalize_for_matching() ("I'm" becomes "im"); anything a joke, a quote or
+# a school essay could contain belongs to the classifier
+CRISIS_LEXICON = [
+    "i want to kill myself", "i wanna kill myself", "im going to kill myself", "im gonna kill myself",
+    "i am going to kill myself", "i am gonna kill myself", "im planning to kill myself",
+    "i want to end my life", "im going to end my life", "i am going to end my life",
+    "im ending my life", "i am ending my life", "i want to take my own life",
+    "im going to take my own life", "i am going to take my own life",
+    "i want to commit suicide", "im going to commit suicide", "i am going to commit suicide",
+    "im planning my suicide", "i am planning my suicide", "this is my suicide note",
+    "im going to hang myself", "i am going to hang myself",
+    "im going to slit my wrists", "i am going to slit my wrists",
+    "i dont want to live anymore", "i dont want to be alive anymore", "i have nothing to live for",
+    "everyone would be better off without me", "everyone would be better off if i was dead",
+]
+LEXICON_LABEL = "suicidal"
+BENIGN_LABEL = "normal"
+
+Decision = namedtuple("Decision", ["route", "label", "score", "reason"])
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_for_matching(text):
+    """Lowercase, drop apostrophes, collapse everything else to single spaces, pad"""
+    text = text.lower().replace("'", "").replace("’", "")
+    return " " + _NON_WORD.sub(" ", text).strip() + " "
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: every pattern is found in one pass over the text"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append(index)
+
+        # Breadth-first failure links, merging the outputs of the fallback state
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find_all(self, text):
+        """Yield (end index, pattern) for every occurrence"""
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._out[state]:
+                yield position, self.patterns[index]
+
+    def search(self, text):
+        """First pattern found in text, or None"""
+        for _, pattern in self.find_all(text):
+            return pattern
+        return None
+
+
+def hashed_ngrams(text, n_features, max_n=2):
+    """Indices of the hashed word 1..max_n-grams of a text (deduplicated)"""
+    words = normalize_for_matching(text).split()
+    grams = []
+    for n in range(1, max_n + 1):
+        grams.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+    # crc32 rather than hash(): stable across processes and runs
+    return np.unique(np.fromiter((zlib.crc32(gram.encode("utf-8")) % n_features for gram in grams),
+                                 dtype=np.int64, count=len(grams)))
+
+
+class HashedLinearModel:
+    """Logistic regression on hashed word n-grams, P(message needs a closer look)"""
+
+    def __init__(self, n_features=2 ** 18, weights=None, bias=0.0):
+        self.n_features = n_features
+        self.weights = np.zeros(n_features, dtype=np.float32) if weights is None else weights
+        self.bias = float(bias)
+
+    def predict_proba(self, text):
+        indices = hashed_ngrams(text, self.n_features)
+        logit = self.bias + float(self.weights[indices].sum())
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    def fit(self, texts, targets, epochs=20, learning_rate=0.5, l2=1e-4, seed=0):
+        """Plain SGD; texts are short, so per-example sparse updates are cheap"""
+        features = [hashed_ngrams(text, self.n_features) for text in texts]
+        targets = np.asarray(targets, dtype=np.float32)
+        order = np.arange(len(texts))
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            rng.shuffle(order)
+            for i in order:
+                indices = features[i]
+                logit = self.bias + self.weights[indices].sum()
+                error = 1.0 / (1.0 + np.exp(-logit)) - targets[i]
+                self.weights[indices] -= learning_rate * (error + l2 * self.weights[indices])
+                self.bias -= learning_rate * error
+        return self
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, n_features=self.n_features)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(int(data["n_features"]), data["weights"].astype(np.float32), float(data["bias"]))
+
+
+class PreFilter:
+    """Lexicon escalation plus benign routing for short low-risk messages"""
+
+    def __init__(self, lexicon=CRISIS_LEXICON, model=None, benign_max_chars=80, benign_threshold=0.05):
+        self.matcher = AhoCorasick([normalize_for_matching(phrase) for phrase in lexicon])
+        self.model = model
+        self.benign_max_chars = benign_max_chars
+        self.benign_threshold = benign_threshold
+
+    def crisis_phrase(self, text):
+        """The CRISIS_LEXICON phrase found in text, or None"""
+        phrase = self.matcher.search(normalize_for_matching(text))
+        return phrase.strip() if phrase is not None else None
+
+    def screen(self, text):
+        """Decision for obvious messages, None when the classifier decides alone
+
+        An escalation has no score (None): the classifier still runs on it.
+        """
+        phrase = self.crisis_phrase(text)
+        if phrase is not None:
+            return Decision("escalate", LEXICON_LABEL, None, phrase)
+
+        if self.model is not None and len(text) <= self.benign_max_chars:
+            risk = self.model.predict_proba(text)
+            if risk < self.benign_threshold:
+                return Decision("benign", BENIGN_LABEL, 1.0 - risk, f"risk {risk:.3f}")
+        return None
+
+
+def load_prefilter(model_path="", benign_max_chars=80, benign_threshold=0.05):
+    """PreFilter with the model saved at model_path, lexicon only when there is none"""
+    model = HashedLinearModel.load(model_path) if model_path and os.path.exists(model_path) else None
+    return PreFilter(model=model, benign_max_chars=benign_max_chars, benign_threshold=benign_threshold)
+
+
+def load_messages(path):
+    """[{"text", optional "label"}] from JSONL, or one message per line"""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line) for line in lines]
+    return [{"text": line} for line in lines]
+
+
+def _load_transformer():
+    from classifier_backends import backend_settings_from_env, load_classifier
+    return load_classifier(token=os.getenv("HF_API_TOKEN"), **backend_settings_from_env())
+
+
+def transformer_decisions(classifier, texts, batch_size=32):
+    """[(label, score)] from the transformer for each text"""
+    results = classifier(texts, truncation=True, batch_size=batch_size)
+    return [(result["label"], result["score"]) for result in results]
+
+
+def recall_report(prefilter, records, decisions, rule=None):
+    """Counts of what the pre-filter did with the crisis messages of a labelled set
+
+    A crisis message counts as missed when the pre-filter routed it as
+    benign. "Gold" uses the labels in the file, "transformer" the
+    classifier's own critical decisions under `rule` (see is_critical).
+    """
+    rule = rule or {}
+    report = {"messages": len(records), "routes": {"escalate": 0, "benign": 0, "classifier": 0}}
+    for reference in ("gold", "transformer"):
+        report[reference] = {"crisis": 0, "missed": 0, "escalated": 0}
+
+    for record, (label, score) in zip(records, decisions):
+        decision = prefilter.screen(record["text"])
+        route = decision.route if decision else "classifier"
+        report["routes"][route] += 1
+
+        crisis = {"transformer": is_critical(label, score, **rule)}
+        if "label" in record:
+            crisis["gold"] = record["label"].lower() in rule.get("critical_labels", CRITICAL_LABELS)
+        for reference, is_crisis in crisis.items():
+            if not is_crisis:
+                continue
+            report[reference]["crisis"] += 1
+            report[reference]["missed"] += route == "benign"
+            report[reference]["escalated"] += route == "escalate"
+
+    for reference in ("gold", "transformer"):
+        counts = report[reference]
+        counts["recall"] = 1.0 - counts["missed"] / counts["crisis"] if counts["crisis"] else None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the classifier pre-filter")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit the hashed n-gram model")
+    train.add_argument("messages", help=".jsonl with text (and label) or a text file, one message per line")
+    train.add_argument("--out", default="prefilter_model.npz")
+    train.add_argument("--use-labels", action="store_true",
+                       help="train on the file's labels instead of the transformer's decisions")
+    train.add_argument("--epochs", type=int, default=20)
+
+    report = commands.add_parser("report", help="recall of the pre-filter on a labelled set")
+    report.add_argument("messages", help=".jsonl with text and label")
+    report.add_argument("--model", default=os.getenv("PREFILTER_MODEL_PATH", ""))
+    report.add_argument("--benign-threshold", type=float,
+                        default=float(os.getenv("PREFILTER_BENIGN_THRESHOLD", "0.05")))
+    args = parser.parse_args()
+
+    records = load_messages(args.messages)
+    texts = [record["text"] for record in records]
+
+    if args.command == "train":
+        if args.use_labels:
+            # Anything with a non-normal label must not be routed as benign
+            targets = [record["label"].lower() != BENIGN_LABEL for record in records]
+        else:
+            targets = [label.lower() != BENIGN_LABEL
+                       for label, _ in transformer_decisions(_load_transformer(), texts)]
+        model = HashedLinearModel().fit(texts, targets, epochs=args.epochs)
+        model.save(args.out)
+        print(f"trained on {len(texts)} messages ({sum(targets)} not normal), saved {args.out}")
+        return
+
+    model = HashedLinearModel.load(args.model) if args.model else None
+    prefilter = PreFilter(model=model, benign_threshold=args.benign_threshold)
+    from pipeline_config import PipelineConfig
+    result = recall_report(prefilter, records, transformer_decisions(_load_transformer(), texts),
+                           PipelineConfig.from_env().alert_rule())
+
+    routes = result["routes"]
+    print(f"{result['messages']} messages: {routes['escalate']} escalated by the lexicon, "
+          f"{routes['benign']} routed as benign, {routes['classifier']} sent to the classifier")
+    for reference in ("gold", "transformer"):
+        counts = result[reference]
+        if not counts["crisis"]:
+            continue
+        print(f"{reference:>11}: {counts['crisis']} crisis messages, {counts['missed']} missed, "
+              f"{counts['escalated']} escalated by the lexicon, recall {counts['recall']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Cache of Gemma replies for repeated small talk
+
+Greetings and short acknowledgements make up much of the traffic, and
+each one costs a full gemma:2b generation. ReplyCache answers a repeat
+from memory:
+
+- exact layer: a TTLCache keyed on the normalized message plus the model
+  and generation options, so "Hi!" and "hi" share a reply.
+- semantic layer (optional): a small in-memory vector index over hashed
+  character trigrams finds near-duplicates ("thank you soo much" for
+  "thank you so much") above a cosine similarity threshold and serves
+  the cached reply of the nearest one. Trigrams cannot see meaning: "i
+  feel good today" and "i dont feel good today" score 0.83, so the
+  default threshold is 0.9 and a match is refused whenever the two
+  messages differ in a negation word.
+
+The app only consults it for short messages the classifier has marked
+non-critical, and only stores replies Gemma wrote without any earlier
+turns of the conversation in its prompt: a reply written with one
+user's history can mention what that user said, so it is never served
+to anyone else.
+"""
+
+import json
+import threading
+import zlib
+
+import numpy as np
+
+from message_cache import TTLCache, normalize_text
+
+# After normalize_text(), so apostrophes are already gone ("don't" -> "dont")
+NEGATIONS = frozenset([
+    "no", "not", "nope", "never", "nothing", "nobody", "none", "nor", "neither", "without", "hardly",
+    "cannot", "cant", "dont", "doesnt", "didnt", "isnt", "arent", "wasnt", "werent", "wont", "wouldnt",
+    "shouldnt", "couldnt", "havent", "hasnt", "hadnt", "aint", "nah",
+])
+
+
+def embed(text, dim=1024):
+    """L2-normalized hashed character-trigram counts of a normalized text"""
+    padded = f" {normalize_text(text)} "
+    vector = np.zeros(dim, dtype=np.float32)
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def negations(normalized):
+    """Negation words in a normalized text"""
+    return NEGATIONS.intersection(normalized.split())
+
+
+class VectorIndex:
+    """Fixed-capacity cosine-similarity index; the oldest rows are overwritten"""
+
+    def __init__(self, capacity=1024, dim=1024):
+        self.dim = dim
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._keys = [None] * capacity
+        self._next = 0
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, text):
+        vector = embed(text, self.dim)
+        with self._lock:
+            row = self._positions.get(key)
+            if row is None:
+                row = self._next
+                self._next = (self._next + 1) % len(self._keys)
+                old_key = self._keys[row]
+                if old_key is not None:
+                    del self._positions[old_key]
+                self._keys[row] = key
+                self._positions[key] = row
+            self._vectors[row] = vector
+
+    def nearest(self, text):
+        """(key, similarity) of the closest stored text, or (None, 0.0)"""
+        vector = embed(text, self.dim)
+        with self._lock:
+            if not self._positions:
+                return None, 0.0
+            similarities = self._vectors @ vector
+            row = int(np.argmax(similarities))
+            return self._keys[row], float(similarities[row])
+
+    def clear(self):
+        with self._lock:
+            self._vectors[:] = 0.0
+            self._keys = [None] * len(self._keys)
+            self._positions.clear()
+            self._next = 0
+
+
+class ReplyCache:
+    """Exact and near-duplicate reply lookup with TTL and size bounds"""
+
+    def __init__(self, maxsize=512, ttl=3600, path=None, semantic=False, similarity=0.9):
+        self.replies = TTLCache(maxsize=maxsize, ttl=ttl, path=path, table="replies")
+        self.index = VectorIndex(capacity=maxsize) if semantic else None
+        self.similarity = similarity
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, model, options=None):
+        """Normalized message plus everything that changes the reply"""
+        return f"{model}:{json.dumps(options or {}, sort_keys=True)}:{normalize_text(text)}"
+
+    def get(self, text, model, options=None, count=True):
+        """(reply, "exact" | "semantic") or (None, None); count=False leaves the hit/miss counters alone"""
+        key = self.make_key(text, model, options)
+        reply = self.replies.get(key)
+        if reply is not None:
+            self.exact_hits += count
+            return reply, "exact"
+
+        if self.index is not None:
+            neighbour, similarity = self.index.nearest(text)
+            # Keys carry the model and options, so a neighbour from another model never matches
+            normalized = normalize_text(text)
+            namespace = key[:len(key) - len(normalized)]
+            if (neighbour is not None and similarity >= self.similarity and neighbour.startswith(namespace)
+                    # "no thanks" is not "thanks", however close the trigrams are
+                    and negations(neighbour[len(namespace):]) == negations(normalized)):
+                reply = self.replies.get(neighbour)
+                if reply is not None:
+                    self.semantic_hits += count
+                    return reply, "semantic"
+
+        self.misses += count
+        return None, None
+
+    def set(self, text, model, reply, options=None):
+        key = self.make_key(text, model, options)
+        self.replies.set(key, reply)
+        if self.index is not None:
+            self.index.add(key, text)
+
+    def clear(self):
+        self.replies.clear()
+        if self.index is not None:
+            self.index.clear()
+        self.exact_hits = self.semantic_hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters for display"""
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "size": len(self.replies),
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,76 @@
+"""Conversation-level risk tracking with exponentially decayed scores
+
+Each turn is classified on its own, so a user who sends several
+moderately worrying messages in a row never triggers the single-message
+alert. ConversationRiskTracker keeps an exponentially weighted average
+of the classifier score per label across the session:
+
+    risk = decay * risk + (1 - decay) * score
+
+Labels that were not seen in a turn decay lazily: every label stores
+the turn it was last updated and is brought up to date only when it is
+read or updated, so a turn costs O(1) no matter how long the
+conversation is.
+"""
+
+
+class ConversationRiskTracker:
+    """Rolling per-label risk for one conversation"""
+
+    def __init__(self, decay=0.6, threshold=0.5, labels=None):
+        self.decay = decay
+        self.threshold = threshold
+        # Only these labels can raise a sustained-risk alert (all when None)
+        self.labels = {label.lower() for label in labels} if labels else None
+        self.turn = 0
+        self._scores = {}
+
+    def _current(self, label):
+        score, updated_at = self._scores.get(label, (0.0, self.turn))
+        return score * self.decay ** (self.turn - updated_at)
+
+    def update(self, label, score):
+        """Record one classified turn and return the label's rolling risk"""
+        self.turn += 1
+        label = label.lower()
+        # _current() already applies one decay step per turn since the last update
+        risk = self._current(label) + (1 - self.decay) * score
+        self._scores[label] = (risk, self.turn)
+        return risk
+
+    def risk(self, label):
+        """Rolling risk of a label as of the latest turn"""
+        return self._current(label.lower())
+
+    def scores(self):
+        """All rolling risks as of the latest turn"""
+        return {label: self._current(label) for label in self._scores}
+
+    def sustained_risk(self):
+        """(label, risk) of the highest tracked label at or above the threshold, else None"""
+        best = None
+        for label in self._scores:
+            if self.labels is not None and label not in self.labels:
+                continue
+            risk = self._current(label)
+            if risk >= self.threshold and (best is None or risk > best[1]):
+                best = (label, risk)
+        return best
+
+    def max_risk(self):
+        """Highest rolling risk among the tracked labels (0.0 before any turn)"""
+        risks = [self._current(label) for label in self._scores
+                 if self.labels is None or label in self.labels]
+        return max(risks, default=0.0)
+
+    def reset(self):
+        self.turn = 0
+        self._scores.clear()
+
+    def state(self):
+        """JSON-serializable snapshot, for restore() on a new tracker"""
+        return {"turn": self.turn, "scores": {label: list(value) for label, value in self._scores.items()}}
+
+    def restore(self, state):
+        self.turn = state["turn"]
+        self._scores = {label: tuple(value) for label, value in state["scores"].items()}
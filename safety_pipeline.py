@@ -0,0 +1,733 @@
+"""The safety pipeline without any user interface
+
+Classification (pre-filter, classifier cache, chunking), the Gemma
+generation queue, the reply cache and the alert rules live here, so
+app.py, the API server (api_server.py), the command-line chats
+(MergeChatbotPipeLineOfflineByMe.py, Model01.py, Model02.py) and the
+benchmarks all run the same code. Settings are read from the environment
+(and .env) once at import into CONFIG, a pipeline_config.PipelineConfig.
+
+Models, clients and caches are built once per process by the getters
+marked @shared and used by every session and request: a Streamlit
+server, an API server and a benchmark run each hold one classifier and
+one Ollama connection pool however many users they serve.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+
+from calibration import ThresholdScorer
+from chat_store import ChatStore
+from classifier_backends import import_backend, load_classifier
+from classifier_service import BatchingClassifier
+from classifier_workers import WorkerPoolClassifier, create_worker_pool_classifier
+from conversation_context import ConversationContext
+from generation_scheduler import GenerationScheduler, SchedulerBusy
+from message_cache import TTLCache, normalize_text
+from metrics import REGISTRY
+from model_loader import ModelLoader
+from pipeline_config import PipelineConfig
+from ndjson_stream import OllamaStreamError, generation_stats
+from prefilter import LEXICON_LABEL, load_prefilter
+from reply_cache import ReplyCache
+from risk_tracker import ConversationRiskTracker
+from session_manager import SessionManager
+from safety_rules import is_critical, pick_label
+from text_chunking import chunk_text, max_scores_per_label, needs_chunking
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Classifier, cache, queue, session and Ollama settings, read once per process
+CONFIG = PipelineConfig.from_env()
+# Thresholds and critical labels for safety_rules.is_critical / pick_label
+ALERT_RULE = CONFIG.alert_rule()
+
+# Sent instead of a reply when the generation queue sheds a request
+BUSY_MESSAGE = ("I'm talking with a lot of people right now and can't reply just yet. "
+                "Please send your message again in a minute. If you need help urgently, "
+                "the emergency contacts in the sidebar are available 24/7. 💙")
+
+
+def shared(factory):
+    """Build the resource on first use and hand the same instance to every caller
+
+    Thread-safe, so concurrent first requests do not load the model twice.
+    `.clear()` drops the instance, like st.cache_resource.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.clear = instance.clear
+    return get
+
+
+def build_mental_health_classifier():
+    """Build the classifier for the configured backend"""
+    # CLASSIFIER_BACKEND picks torch, onnx or onnx-int8
+    settings = CONFIG.classifier_settings()
+    classifier = load_classifier(token=CONFIG.hf_token, **settings)
+    # CLASSIFIER_WORKERS forks worker processes here, before the warmup runs
+    classifier = create_worker_pool_classifier(
+        classifier, settings["backend"], load=lambda: load_classifier(token=CONFIG.hf_token, **settings),
+        workers=CONFIG.classifier_workers, threads=CONFIG.classifier_worker_threads
+    )
+    if CONFIG.classifier_batching and not isinstance(classifier, WorkerPoolClassifier):
+        # One shared worker batches messages from every session
+        classifier = BatchingClassifier(
+            classifier, CONFIG.classifier_max_batch_size, CONFIG.classifier_max_wait_ms
+        )
+    return classifier
+
+
+@shared
+def get_model_loader():
+    """Start loading and warming up the classifier in the background"""
+    loader = ModelLoader(
+        load=build_mental_health_classifier,
+        imports=lambda: import_backend(CONFIG.backend, CONFIG.model_id, CONFIG.classifier_offline)
+    )
+    return loader.start()
+
+
+def load_mental_health_classifier(wait=True):
+    """Load the mental health classifier model
+
+    With wait=False this returns None while the model is still loading
+    instead of blocking the page render.
+    """
+    loader = get_model_loader()
+    if not wait and not loader.ready:
+        return None
+
+    return loader.wait()
+
+
+@shared
+def get_classification_cache():
+    """Classification results shared by all sessions, keyed on normalized text"""
+    if CONFIG.classification_cache_size <= 0:
+        return None
+    return TTLCache(
+        maxsize=CONFIG.classification_cache_size,
+        ttl=CONFIG.classification_cache_ttl,
+        path=CONFIG.classification_cache_path or None,
+        table="classifications"
+    )
+
+
+def classify_in_chunks(user_text, classifier):
+    """Classify a long message sentence by sentence and keep the highest risk"""
+    chunks, truncated = chunk_text(
+        user_text, getattr(classifier, "tokenizer", None), CONFIG.chunk_max_tokens, CONFIG.chunk_budget
+    )
+    if truncated:
+        logger.info(
+            "Message needed more than %d chunks; middle chunks were skipped", CONFIG.chunk_budget
+        )
+
+    # One batched call with every label's score for every chunk
+    scores = max_scores_per_label(classifier(chunks, top_k=None, truncation=True))
+
+    # A single critical chunk decides the message, otherwise the overall top label
+    return pick_label(scores, **ALERT_RULE)
+
+
+@shared
+def get_threshold_scorer():
+    """Vectorized per-label thresholds with CALIBRATED_SCORING=true, None when disabled"""
+    if not CONFIG.calibrated_scoring:
+        return None
+    return ThresholdScorer(dict(CONFIG.label_thresholds), CONFIG.threshold, CONFIG.critical_labels)
+
+
+@shared
+def get_prefilter():
+    """Lexicon and hashed n-gram screen shared by all sessions, None when disabled"""
+    if not CONFIG.prefilter:
+        return None
+    return load_prefilter(
+        CONFIG.prefilter_model_path, CONFIG.prefilter_benign_max_chars, CONFIG.prefilter_benign_threshold
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def classification_cache_namespace():
+    """Everything besides the text that changes a classification result"""
+    # Chunked and calibrated results pick their label with the alert thresholds
+    rule = "-"
+    if CONFIG.chunked_classification or CONFIG.calibrated_scoring:
+        thresholds = json.dumps([CONFIG.threshold, CONFIG.critical_labels, CONFIG.label_thresholds])
+        rule = hashlib.sha1(thresholds.encode("utf-8")).hexdigest()[:12]
+    return (f"{CONFIG.model_id}:{CONFIG.backend}:{int(CONFIG.chunked_classification)}:"
+            f"{int(CONFIG.calibrated_scoring)}:{rule}")
+
+
+def classification_cache_key(user_text):
+    """Key of a message in the classification cache"""
+    # Another model, backend or set of thresholds may give another result, so they are part of the key
+    return f"{classification_cache_namespace()}:{normalize_text(user_text)}"
+
+
+def crisis_phrase(user_text):
+    """Unmistakable crisis wording found by the pre-filter's lexicon, None without a match or pre-filter"""
+    prefilter = get_prefilter()
+    return prefilter.crisis_phrase(user_text) if prefilter is not None else None
+
+
+def known_classification(user_text, classifier):
+    """(label, score) from the pre-filter or the cache, None when the classifier has to run"""
+    prefilter = get_prefilter()
+    if prefilter is not None:
+        # Clearly benign short messages skip the transformer; escalations are still scored by it
+        decision = prefilter.screen(user_text)
+        REGISTRY.inc("prefilter", route=decision.route if decision else "classifier")
+        if decision is not None and decision.route == "benign":
+            return decision.label, decision.score
+
+    if not classifier:
+        return "unknown", 0.0
+
+    cache = get_classification_cache()
+    if cache is not None:
+        cached = cache.get(classification_cache_key(user_text))
+        if cached is not None:
+            return cached[0], cached[1]
+    return None
+
+
+def needs_chunked_classification(user_text, classifier):
+    return CONFIG.chunked_classification and needs_chunking(
+        user_text, getattr(classifier, "tokenizer", None), CONFIG.chunk_max_tokens
+    )
+
+
+def check_mental_health(user_text, classifier):
+    """Check mental health status of user input"""
+    known = known_classification(user_text, classifier)
+    if known is not None:
+        return known
+    return run_classifier(user_text, classifier)
+
+
+def run_classifier(user_text, classifier):
+    """Classify one message with the transformer and cache the result"""
+    try:
+        if needs_chunked_classification(user_text, classifier):
+            label, score = classify_in_chunks(user_text, classifier)
+        elif get_threshold_scorer() is not None:
+            label, score = get_threshold_scorer().classify(classifier, [user_text])[0]
+        else:
+            result = classifier(user_text, truncation=True)[0]
+            label, score = result['label'], result['score']
+        cache = get_classification_cache()
+        if cache is not None:
+            cache.set(classification_cache_key(user_text), [label, score])
+        return label, score
+    except Exception as e:
+        logger.error("Error in mental health classification: %s", e)
+        return "error", 0.0
+
+
+def check_mental_health_batch(texts, classifier, batch_size=32):
+    """(label, score) for every text, same results as check_mental_health one by one
+
+    Short messages that are neither pre-filtered nor cached go to the
+    classifier together in one call; long ones are chunked one at a time.
+    """
+    results = [known_classification(text, classifier) for text in texts]
+    batch = []
+    for index, text in enumerate(texts):
+        if results[index] is not None:
+            continue
+        if needs_chunked_classification(text, classifier):
+            results[index] = run_classifier(text, classifier)
+        else:
+            batch.append(index)
+
+    if batch:
+        batch_texts = [texts[index] for index in batch]
+        scorer = get_threshold_scorer()
+        try:
+            if scorer is not None:
+                # Every label's score for the whole batch, thresholded in one pass
+                decisions = scorer.classify(classifier, batch_texts, batch_size)
+            else:
+                outputs = classifier(batch_texts, truncation=True, batch_size=batch_size)
+                # A single input string gives [top]; in a list each item is the top dict
+                outputs = [output[0] if isinstance(output, list) else output for output in outputs]
+                decisions = [(output["label"], output["score"]) for output in outputs]
+        except Exception as e:
+            logger.error("Error in mental health classification: %s", e)
+            decisions = [None] * len(batch)
+        cache = get_classification_cache()
+        for index, decision in zip(batch, decisions):
+            if decision is None:
+                results[index] = ("error", 0.0)
+                continue
+            results[index] = decision
+            if cache is not None:
+                cache.set(classification_cache_key(texts[index]), list(results[index]))
+    return results
+
+
+@shared
+def get_ollama_client():
+    """Pooled keep-alive Ollama client (or pool of backends) shared by all sessions"""
+    return CONFIG.build_client()
+
+
+@shared
+def get_generation_scheduler():
+    """Concurrency limit and wait queue for Gemma shared by all sessions"""
+    return GenerationScheduler(
+        max_concurrent=CONFIG.generation_max_concurrent,
+        max_queue=CONFIG.generation_max_queue
+    )
+
+
+def acquire_generation_slot(scheduler, priority=0, on_queue=None, cancelled=None):
+    """Wait for a Gemma slot; False when shed (queue full or wait timed out) or cancelled"""
+    started_at = time.perf_counter()
+    try:
+        admitted = scheduler.acquire(priority, CONFIG.generation_queue_timeout, on_queue, cancelled)
+    except SchedulerBusy as e:
+        logger.warning("Generation shed: %s", e)
+        REGISTRY.inc("generations_shed")
+        return False
+    REGISTRY.observe("generation_queue", time.perf_counter() - started_at)
+    return admitted
+
+
+def open_chat_stream(user_text, client=None, conversation=None):
+    """Start a streaming Gemma request and return the generation stream"""
+    client = client or get_ollama_client()
+    if conversation is not None:
+        # Recent turns and summary, or Ollama's cached context from the last reply
+        prompt, options = conversation.prepare(user_text)
+    else:
+        prompt, options = f"User: {user_text}\nAssistant:", {}
+    with REGISTRY.timer("ollama_connect"):
+        return client.open_stream(prompt, **options)
+
+
+def iter_chat_tokens(stream, started_at, conversation=None):
+    """Yield reply tokens from a streaming Gemma response
+
+    Records time to first token and full generation time, both measured
+    from started_at (just before the request was sent), and Ollama's own
+    prompt and generation timings from the closing chunk. A finished
+    reply is added to the conversation together with Ollama's context.
+    """
+    try:
+        first = True
+        parts = []
+        for token in stream:
+            if first:
+                REGISTRY.observe("first_token", time.perf_counter() - started_at)
+                first = False
+            parts.append(token)
+            yield token
+        REGISTRY.observe("generation", time.perf_counter() - started_at)
+        stats = generation_stats(stream.final)
+        if "prompt_eval_duration" in stats:
+            REGISTRY.observe("ollama_prompt_eval", stats["prompt_eval_duration"])
+        if "eval_duration" in stats:
+            REGISTRY.observe("ollama_eval", stats["eval_duration"])
+        if conversation is not None:
+            conversation.complete("".join(parts).strip(), stream.final)
+    except OllamaStreamError as e:
+        yield f"[Error] Gemma API reported an error: {str(e)}"
+    except ValueError as e:
+        yield f"[Error] Failed to parse API response: {str(e)}"
+    except requests.exceptions.RequestException as e:
+        yield f"[Error] Gemma API stream interrupted: {str(e)}"
+    finally:
+        # Closing returns the connection even when the consumer stops early
+        stream.close()
+
+
+def stream_chat_response(user_text, conversation=None, priority=0, on_queue=None, cancelled=None):
+    """Stream the Gemma AI reply token by token
+
+    Waits for a slot from the generation scheduler first; on_queue(position)
+    is called while waiting, and a busy message is returned when shed.
+    Setting the `cancelled` event gives up the wait.
+    """
+    if not CONFIG.gemma_url:
+        yield "[Error] Gemma API URL not configured"
+        return
+
+    scheduler = get_generation_scheduler()
+    if not acquire_generation_slot(scheduler, priority, on_queue, cancelled):
+        if cancelled is None or not cancelled.is_set():
+            yield BUSY_MESSAGE
+        return
+
+    try:
+        started_at = time.perf_counter()
+        try:
+            stream = open_chat_stream(user_text, conversation=conversation)
+        except requests.exceptions.RequestException as e:
+            yield f"[Error] Could not reach Gemma API: {str(e)}"
+            return
+
+        yield from iter_chat_tokens(stream, started_at, conversation)
+    finally:
+        scheduler.release()
+
+
+@shared
+def get_reply_cache():
+    """Replies to short small-talk messages shared by all sessions, None when disabled"""
+    if CONFIG.reply_cache_size <= 0:
+        return None
+    return ReplyCache(
+        maxsize=CONFIG.reply_cache_size,
+        ttl=CONFIG.reply_cache_ttl,
+        path=CONFIG.reply_cache_path or None,
+        semantic=CONFIG.reply_cache_semantic,
+        similarity=CONFIG.reply_cache_similarity
+    )
+
+
+def lookup_cached_reply(user_text, count=True):
+    """Cached reply for a short message, or None; count=False keeps the lookup out of the metrics"""
+    cache = get_reply_cache()
+    if cache is None or len(user_text) > CONFIG.reply_cache_max_chars:
+        return None
+    reply, match = cache.get(user_text, get_ollama_client().model, count=count)
+    if count:
+        REGISTRY.inc("reply_cache", result=match or "miss")
+    return reply
+
+
+def replay(reply):
+    """A cached reply as a one-token stream, closable like a generation"""
+    yield reply
+
+
+def cache_reply(user_text, tokens):
+    """Pass tokens through and cache the finished reply of a short message"""
+    cache = get_reply_cache()
+    if cache is None or len(user_text) > CONFIG.reply_cache_max_chars:
+        yield from tokens
+        return
+    model = get_ollama_client().model
+    parts = []
+    try:
+        for token in tokens:
+            parts.append(token)
+            yield token
+    finally:
+        # Closing this generator closes the generation it wraps
+        tokens.close()
+    reply = "".join(parts).strip()
+    # Never cache failures; a partly read stream does not get here
+    if reply and "[Error]" not in reply and reply != BUSY_MESSAGE:
+        cache.set(user_text, model, reply)
+
+
+def join_reply(tokens):
+    """Join streamed tokens into the final reply text"""
+    full_reply = "".join(tokens).strip()
+    return full_reply if full_reply else "I apologize, but I couldn't generate a response."
+
+
+def get_chat_response(user_text, conversation=None):
+    """Get response from Gemma AI model"""
+    return join_reply(stream_chat_response(user_text, conversation))
+
+
+class SpeculativeReply:
+    """Gemma generation started in the background before classification finishes
+
+    Tokens are buffered and only handed out by iterating, so nothing reaches
+    the UI until the caller has decided the message is not critical. The
+    turn joins the conversation only once the caller has read the whole
+    reply: a generation that finishes before its message raises the alert
+    leaves Gemma's memory untouched. Setting the `abandoned` event (the
+    caller went away) ends the iteration, which cancels the generation.
+    """
+
+    _DONE = object()
+
+    def __init__(self, user_text, conversation=None, priority=0, abandoned=None):
+        self._tokens = queue.Queue()
+        self._cancelled = threading.Event()
+        self._abandoned = abandoned
+        self._conversation = conversation
+        self._stream = None
+        # Ollama's closing chunk once the generation finished, for conversation.complete()
+        self._final = None
+        # Resolved up front so the background thread only has to generate
+        self._client = get_ollama_client()
+        self._scheduler = get_generation_scheduler()
+        self._thread = threading.Thread(
+            target=self._run, args=(user_text, conversation, priority), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, user_text, conversation, priority):
+        try:
+            if not CONFIG.gemma_url:
+                self._tokens.put("[Error] Gemma API URL not configured")
+                return
+            # No queue position feedback here: nobody reads the tokens until classification is done
+            admitted = acquire_generation_slot(self._scheduler, priority, cancelled=self._cancelled)
+            if not admitted:
+                if not self._cancelled.is_set():
+                    self._tokens.put(BUSY_MESSAGE)
+                return
+            try:
+                self._generate(user_text, conversation)
+            finally:
+                self._scheduler.release()
+        except Exception as e:
+            # A cancelled stream fails mid-read once its connection is closed
+            if not self._cancelled.is_set():
+                self._tokens.put(f"[Error] Gemma API stream failed: {str(e)}")
+        finally:
+            self._tokens.put(self._DONE)
+
+    def _generate(self, user_text, conversation):
+        started_at = time.perf_counter()
+        try:
+            self._stream = open_chat_stream(user_text, self._client, conversation)
+        except requests.exceptions.RequestException as e:
+            self._tokens.put(f"[Error] Could not reach Gemma API: {str(e)}")
+            return
+        if self._cancelled.is_set():
+            # cancel() ran while the connection was being opened and had no stream to close
+            self._stream.close()
+            if conversation is not None:
+                conversation.discard()
+            return
+
+        # No conversation here: __iter__ completes the turn once the caller has read it
+        for token in iter_chat_tokens(self._stream, started_at):
+            if self._cancelled.is_set():
+                break
+            self._tokens.put(token)
+        else:
+            self._final = self._stream.final
+
+    def cancel(self):
+        """Abort the generation and close the HTTP stream"""
+        self._cancelled.set()
+        if self._conversation is not None:
+            # The prepared turn was never shown, so it stays out of Gemma's memory
+            self._conversation.discard()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+
+    def __iter__(self):
+        parts = []
+        try:
+            while True:
+                try:
+                    # Wake up now and then to notice the caller going away
+                    token = self._tokens.get(timeout=None if self._abandoned is None else 0.5)
+                except queue.Empty:
+                    if self._abandoned.is_set():
+                        return
+                    continue
+                if self._cancelled.is_set():
+                    return
+                if token is self._DONE:
+                    if self._final is not None and self._conversation is not None:
+                        self._conversation.complete("".join(parts).strip(), self._final)
+                    return
+                parts.append(token)
+                yield token
+        finally:
+            # Closing the iterator early (client gone, UI rerun) stops the generation too
+            self.cancel()
+
+
+def build_alert_message(label, score=None, sustained=False):
+    """Alert text with helpline details for a critical label (no score: raised by a crisis phrase)"""
+    if sustained:
+        heading = "🚨 **Ongoing Mental Health Concern Detected**"
+        detail = f"**Conversation Risk Level**: {score:.1%} across your recent messages"
+    elif score is None:
+        heading = "🚨 **Critical Mental Health Alert Detected**"
+        detail = "**Detected From**: the wording of your message"
+    else:
+        heading = "🚨 **Critical Mental Health Alert Detected**"
+        detail = f"**Confidence Level**: {score:.1%}"
+
+    return f"""
+        {heading}
+
+        **Detected Issue**: {label.title()}
+        {detail}
+
+        **Immediate Support Available**:
+        • **AASRA Helpline (India)**: 9152987821
+        • **National Suicide Prevention Lifeline**: 988
+        • **Crisis Text Line**: Text HOME to 741741
+
+        Please reach out to a mental health professional or trusted person immediately.
+        Your life matters, and help is available. 💙
+        """
+
+
+def generation_priority(risk_tracker):
+    """1 for users whose recent messages scored high, else 0"""
+    if risk_tracker is not None and risk_tracker.max_risk() >= CONFIG.generation_priority_risk:
+        return 1
+    return 0
+
+
+def chatbot_pipeline(user_text, classifier, stream=False, speculative=False, risk_tracker=None,
+                     conversation=None, on_queue=None, cancelled=None):
+    """Main chatbot pipeline with mental health checking
+
+    With stream=True the reply is returned as a generator of tokens
+    instead of the finished string. With speculative=True Gemma starts
+    generating while the classifier runs and is cancelled for critical
+    messages. A ConversationRiskTracker passed as risk_tracker also
+    raises the alert when risk stays elevated over several messages, and
+    a ConversationContext gives Gemma the earlier turns. Short messages
+    with a cached reply are answered from the reply cache, but only once
+    the classifier has cleared them; only replies generated without
+    earlier turns in the prompt are cached, so no conversation's details
+    reach another user. Gemma requests wait in the shared
+    generation queue; on_queue(position) reports the queue position.
+    Setting the `cancelled` event (the client disconnected) stops a
+    generation that is still queued or running.
+    """
+    phrase = crisis_phrase(user_text)
+    # Checked before the prompt is built: a reply written with this
+    # conversation's history is private to it and must not be cached
+    context_free = conversation is None or not conversation.has_history()
+    generation = None
+    # No head start for a message the reply cache is likely to answer
+    if speculative and phrase is None and not (context_free and lookup_cached_reply(user_text, count=False)):
+        generation = SpeculativeReply(user_text, conversation, generation_priority(risk_tracker), cancelled)
+
+    # Mental health check
+    with REGISTRY.timer("classification"):
+        label, score = check_mental_health(user_text, classifier)
+    REGISTRY.inc("classifications", label=label.lower())
+
+    sustained = None
+    if risk_tracker is not None:
+        risk_tracker.update(label, score)
+        sustained = risk_tracker.sustained_risk()
+
+    # Check for critical mental health indicators
+    if is_critical(label, score, **ALERT_RULE):
+        alert_msg = build_alert_message(label, score)
+        REGISTRY.inc("alerts", label=label.lower(), kind="message")
+    elif phrase is not None:
+        # Stated intent alerts even when the classifier scores it below the threshold
+        alert_msg = build_alert_message(LEXICON_LABEL)
+        REGISTRY.inc("alerts", label=LEXICON_LABEL, kind="phrase")
+    elif sustained is not None:
+        alert_msg = build_alert_message(sustained[0], sustained[1], sustained=True)
+        REGISTRY.inc("alerts", label=sustained[0], kind="sustained")
+    else:
+        alert_msg = None
+
+    if alert_msg is not None:
+        if generation is not None:
+            generation.cancel()
+        return None, alert_msg, label, score
+
+    # Repeated small talk: no generation needed. Looked up only now, so messages
+    # that alert never count as hits, and only without earlier turns in the prompt
+    cached_reply = lookup_cached_reply(user_text) if context_free else None
+    if cached_reply is not None:
+        if generation is not None:
+            generation.cancel()
+        if conversation is not None:
+            # Gemma's memory gets the turn as if it had generated it
+            conversation.add_turn(user_text, cached_reply)
+        return (replay(cached_reply) if stream else cached_reply), None, label, score
+
+    # Normal conversation
+    if generation is not None:
+        tokens = iter(generation)
+    else:
+        tokens = stream_chat_response(user_text, conversation, generation_priority(risk_tracker), on_queue,
+                                      cancelled)
+    if context_free:
+        tokens = cache_reply(user_text, tokens)
+    if stream:
+        return tokens, None, label, score
+    reply = join_reply(tokens)
+    return reply, None, label, score
+
+
+@shared
+def get_chat_store():
+    """Append-only chat log shared by all sessions"""
+    # Without CHAT_STORE_PATH a temporary file: evicted sessions leave the process's memory
+    return ChatStore(CONFIG.chat_store_path or None)
+
+
+@shared
+def get_session_manager():
+    """In-memory state of every open conversation, capped per session and evicted when idle"""
+    return SessionManager(
+        get_chat_store(), new_risk_tracker, new_conversation,
+        page_size=CONFIG.chat_history_page_size,
+        max_session_bytes=CONFIG.session_memory_cap_kb * 1024,
+        idle_seconds=CONFIG.session_idle_seconds,
+        retention_seconds=CONFIG.chat_retention
+    )
+
+
+def new_chat_entry(user_text, reply, alert, label, score, first_token_latency=None):
+    """One turn of the chat log, in the form ChatStore.append() takes"""
+    return {
+        'user_input': user_text,
+        'bot_response': reply,
+        'alert': alert,
+        'mental_health_label': label,
+        'mental_health_score': score,
+        'first_token_latency': first_token_latency,
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def new_conversation(history=()):
+    """Gemma's memory of this chat, rebuilt from the stored turns (None when disabled)"""
+    if CONFIG.context_token_budget <= 0:
+        return None
+    return ConversationContext.from_history(
+        history,
+        token_budget=CONFIG.context_token_budget,
+        summary_tokens=CONFIG.context_summary_tokens,
+        keep_alive=CONFIG.ollama_keep_alive
+    )
+
+
+def new_risk_tracker():
+    """Rolling conversation risk over the critical labels"""
+    return ConversationRiskTracker(
+        decay=CONFIG.sustained_risk_decay,
+        threshold=CONFIG.sustained_risk_threshold,
+        labels=CONFIG.critical_labels
+    )
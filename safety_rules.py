@@ -0,0 +1,45 @@
+"""Alert rules shared by the chat app and the offline tools
+
+A message is critical when its label is one of CRITICAL_LABELS with a
+score above that label's threshold. Keeping the rule here means the
+Streamlit app and the bulk screening CLI flag exactly the same messages.
+
+Every label uses THRESHOLD unless per-label thresholds are passed in;
+the pipeline passes PipelineConfig.alert_rule(), which holds the ones
+fitted by `python calibration.py fit` when LABEL_THRESHOLDS_PATH points
+at its file. They replace THRESHOLD for the labels they list.
+"""
+
+import json
+
+THRESHOLD = 0.7
+CRITICAL_LABELS = ["suicidewatch", "suicidal", "depression", "stress", "anxiety"]
+
+
+def load_label_thresholds(path):
+    """{label: threshold} from a calibration file"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {label.lower(): float(threshold) for label, threshold in data["thresholds"].items()}
+
+
+def threshold_for(label, thresholds=None, default=THRESHOLD):
+    return thresholds.get(label.lower(), default) if thresholds else default
+
+
+def is_critical(label, score, thresholds=None, default=THRESHOLD, critical_labels=CRITICAL_LABELS):
+    """True when a label/score pair should raise the crisis alert"""
+    return label.lower() in critical_labels and score > threshold_for(label, thresholds, default)
+
+
+def pick_label(scores, **rule):
+    """(label, score) for a message from {label: score}
+
+    A critical label above its threshold wins over a higher-scoring
+    non-critical one; otherwise the top label is returned. `rule` is
+    passed on to is_critical.
+    """
+    critical = {label: score for label, score in scores.items() if is_critical(label, score, **rule)}
+    candidates = critical or scores
+    label = max(candidates, key=candidates.get)
+    return label, candidates[label]
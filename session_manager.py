@@ -0,0 +1,260 @@
+"""Per-conversation state with a memory cap and idle eviction
+
+Every open chat used to keep its history page, label counts, rendered
+HTML, rolling risk and Gemma context in Streamlit session state for as
+long as the tab stayed open, so a server with hundreds of idle tabs kept
+growing. SessionManager holds that state instead, one SessionState per
+conversation, and bounds it three ways:
+
+- turns are Turn objects with __slots__ (no per-turn dict, labels
+  interned) and the chat history page is trimmed to SESSION_MEMORY_CAP_KB,
+  oldest turns first; they stay in the chat store and "Load older
+  messages" reads them back
+- when the turns alone cannot bring a session under the cap, the
+  rendered HTML cache and then Gemma's context array are dropped (both
+  are rebuilt on demand)
+- a session not used for SESSION_IDLE_SECONDS is evicted: its rolling
+  risk and Gemma context go to the chat store (on disk with
+  CHAT_STORE_PATH, a temporary file otherwise) and everything else is
+  dropped; the next message or page refresh restores it
+- a conversation with no new turn for CHAT_RETENTION_SECONDS is deleted
+  from the chat store as well, so the store does not grow without bound
+
+Sizes are estimates from sys.getsizeof, good enough to compare sessions
+and watch the total in the admin panel.
+"""
+
+import sys
+import threading
+import time
+
+# Keys of a chat entry (see safety_pipeline.new_chat_entry), one slot each
+TURN_FIELDS = ("id", "user_input", "bot_response", "alert", "mental_health_label",
+               "mental_health_score", "first_token_latency", "timestamp")
+
+
+class Turn:
+    """One chat turn, read like the entry dict it is made from (turn['alert'], turn.get('id'))"""
+
+    __slots__ = TURN_FIELDS + ("nbytes",)
+
+    def __init__(self, entry):
+        for field in TURN_FIELDS:
+            setattr(self, field, entry.get(field))
+        if self.mental_health_label:
+            # A handful of labels repeat on every turn
+            self.mental_health_label = sys.intern(self.mental_health_label)
+        self.nbytes = sys.getsizeof(self) + sum(
+            sys.getsizeof(value) for value in (self.user_input, self.bot_response, self.alert, self.timestamp)
+            if value is not None
+        )
+
+    def __getitem__(self, key):
+        if key not in TURN_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in TURN_FIELDS else default
+
+
+def conversation_bytes(conversation):
+    """Estimated size of a ConversationContext"""
+    if conversation is None:
+        return 0
+    size = sys.getsizeof(conversation.turns) + sys.getsizeof(conversation.summary)
+    size += sum(sys.getsizeof(user) + sys.getsizeof(reply) for user, reply in conversation.turns)
+    if conversation.context:
+        # A list of small ints: 8 bytes per slot plus the int objects
+        size += sys.getsizeof(conversation.context) + 28 * len(conversation.context)
+    return size
+
+
+class SessionState:
+    """What one conversation keeps in memory between messages"""
+
+    __slots__ = ("session_id", "turns", "label_counts", "total_messages", "risk_tracker",
+                 "conversation", "rendered", "last_seen", "lock")
+
+    def __init__(self, session_id, turns, label_counts, total_messages, risk_tracker, conversation):
+        self.session_id = session_id
+        self.turns = [Turn(entry) for entry in turns]
+        self.label_counts = label_counts
+        self.total_messages = total_messages
+        self.risk_tracker = risk_tracker
+        self.conversation = conversation
+        # HTML per turn id, rebuilt when missing
+        self.rendered = {}
+        self.last_seen = time.monotonic()
+        # Held while a turn is processed; idle eviction skips a locked session
+        self.lock = threading.Lock()
+
+    def add_turn(self, entry):
+        """Record a stored chat entry (with its 'id') and return its Turn"""
+        turn = Turn(entry)
+        self.turns.append(turn)
+        self.total_messages += 1
+        label = turn.mental_health_label
+        self.label_counts[label] = self.label_counts.get(label, 0) + 1
+        return turn
+
+    def add_older_turns(self, entries):
+        self.turns[:0] = [Turn(entry) for entry in entries]
+
+    def memory_bytes(self):
+        """Estimated size of the turns, rendered HTML and Gemma memory held for this session"""
+        size = sys.getsizeof(self.turns) + sum(turn.nbytes for turn in self.turns)
+        size += sys.getsizeof(self.rendered) + sum(sys.getsizeof(html) for html in self.rendered.values())
+        size += sys.getsizeof(self.label_counts) + conversation_bytes(self.conversation)
+        return size
+
+    def trim(self, max_bytes, max_turns, min_turns=1):
+        """Drop the oldest turns past max_turns, then shed memory down to max_bytes; returns turns dropped"""
+        dropped = max(len(self.turns) - max_turns, 0)
+        size = self.memory_bytes()
+        if max_bytes > 0:
+            while size > max_bytes and len(self.turns) - dropped > min_turns:
+                turn = self.turns[dropped]
+                size -= turn.nbytes + sys.getsizeof(self.rendered.get(turn.id, ""))
+                dropped += 1
+        if dropped:
+            for turn in self.turns[:dropped]:
+                self.rendered.pop(turn.id, None)
+            del self.turns[:dropped]
+
+        if max_bytes > 0 and self.memory_bytes() > max_bytes:
+            self.rendered.clear()
+            if self.conversation is not None and self.memory_bytes() > max_bytes:
+                # Gemma rebuilds its prompt from the summary and the recent turns instead
+                self.conversation.context = None
+        return dropped
+
+    def state(self):
+        """What eviction saves: the parts that cannot be rebuilt from the chat store"""
+        return {
+            "risk": self.risk_tracker.state(),
+            "conversation": self.conversation.state() if self.conversation is not None else None,
+        }
+
+
+class SessionManager:
+    """SessionState by id: loaded or restored on use, capped in size, evicted when idle
+
+    new_risk_tracker() and new_conversation(history) build the per-session
+    objects, so the manager uses the same settings as the rest of the
+    pipeline.
+    """
+
+    def __init__(self, store, new_risk_tracker, new_conversation, page_size=50, max_session_bytes=256 * 1024,
+                 idle_seconds=900, sweep_interval=60, retention_seconds=0):
+        self.store = store
+        self.new_risk_tracker = new_risk_tracker
+        self.new_conversation = new_conversation
+        self.page_size = page_size
+        self.max_session_bytes = max_session_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.retention_seconds = retention_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._counts = {"loaded": 0, "restored": 0, "evicted": 0, "trimmed_turns": 0, "pruned": 0}
+
+    def get(self, session_id):
+        """The session's state, loading it from the store when it is not in memory"""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            if self.idle_seconds > 0:
+                self.evict_idle(now)
+            if self.retention_seconds > 0:
+                self.prune()
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = self._load(session_id)
+            session.last_seen = now
+            return session
+
+    def _load(self, session_id):
+        turns = self.store.recent(session_id, self.page_size)
+        session = SessionState(
+            session_id, turns, self.store.label_counts(session_id), self.store.count(session_id),
+            self.new_risk_tracker(), self.new_conversation(turns)
+        )
+        saved = self.store.pop_session_state(session_id)
+        if saved is not None:
+            session.risk_tracker.restore(saved["risk"])
+            if saved["conversation"] is not None and session.conversation is not None:
+                session.conversation.restore(saved["conversation"])
+            self._counts["restored"] += 1
+        else:
+            self._counts["loaded"] += 1
+        self.trim(session)
+        return session
+
+    def trim(self, session, max_turns=None, min_turns=1):
+        """Keep a session within the page size and the memory cap"""
+        dropped = session.trim(self.max_session_bytes, max_turns or self.page_size, min_turns)
+        self._counts["trimmed_turns"] += dropped
+        return dropped
+
+    def evict_idle(self, now=None):
+        """Save and drop every session unused for idle_seconds; returns how many went"""
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        with self._lock:
+            idle = [session for session in self._sessions.values()
+                    if now - session.last_seen >= self.idle_seconds]
+        return sum(self.evict(session, idle_since=now - self.idle_seconds) for session in idle)
+
+    def evict(self, session, idle_since=None):
+        """Save a session's state to the store and drop it from memory, unless it is in use
+
+        With idle_since, a session used after that time is kept.
+        """
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if self._sessions.get(session.session_id) is not session:
+                    return False
+                if idle_since is not None and session.last_seen > idle_since:
+                    return False
+                # Unlisted first, so a request arriving now loads the saved state
+                del self._sessions[session.session_id]
+                self.store.save_session_state(session.session_id, session.state())
+            self._counts["evicted"] += 1
+            return True
+        finally:
+            session.lock.release()
+
+    def prune(self):
+        """Delete conversations idle for retention_seconds from the store; returns how many"""
+        with self._lock:
+            resident = list(self._sessions)
+        pruned = self.store.prune(self.retention_seconds, keep=resident)
+        self._counts["pruned"] += pruned
+        return pruned
+
+    def discard(self, session_id):
+        """Forget a session entirely (after its chat history was cleared)"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self.store.pop_session_state(session_id)
+
+    def stats(self):
+        """Resident sessions and their estimated memory, the chat store's size, load / eviction counts"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        sizes = [session.memory_bytes() for session in sessions]
+        return {
+            "resident": len(sessions),
+            "bytes": sum(sizes),
+            "largest_bytes": max(sizes, default=0),
+            "turns": sum(len(session.turns) for session in sessions),
+            "store_bytes": self.store.size_bytes(),
+            "store_in_memory": self.store.in_memory,
+            **self._counts,
+        }
@@ -0,0 +1,88 @@
+"""Sentence-level chunking for classifying long messages
+
+The classifier only sees its first few hundred tokens, and one crisis
+sentence in a long message gets diluted by everything around it.
+chunk_text() splits a message into sentence windows that fit a token
+budget; the caller classifies all chunks in one batched call and
+merges them with max_scores_per_label().
+"""
+
+import re
+
+# Sentence ends followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    """Split text into sentences on . ! ? and line breaks"""
+    return [part.strip() for part in SENTENCE_BOUNDARY.split(text) if part and part.strip()]
+
+
+def _token_ids(tokenizer, text):
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def _count_tokens(tokenizer, text):
+    if tokenizer is None:
+        # Rough estimate for subword tokenizers when none is available
+        return int(len(text.split()) * 1.3) + 1
+    return len(_token_ids(tokenizer, text))
+
+
+def _split_long_sentence(tokenizer, sentence, max_tokens):
+    """Cut one over-long sentence into token windows"""
+    if tokenizer is None:
+        words = sentence.split()
+        step = max(1, int(max_tokens / 1.3))
+        return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+
+    ids = _token_ids(tokenizer, sentence)
+    return [tokenizer.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+
+
+def chunk_text(text, tokenizer=None, max_tokens=256, max_chunks=8):
+    """Pack sentences into chunks of at most `max_tokens` tokens
+
+    Returns (chunks, truncated). When the message needs more than
+    `max_chunks` chunks, the first max_chunks - 1 and the last one are
+    kept and `truncated` is True, so the cost per message stays bounded.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for sentence in split_sentences(text):
+        tokens = _count_tokens(tokenizer, sentence)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_sentence(tokenizer, sentence, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+
+    if len(chunks) <= max_chunks:
+        return chunks, False
+    if max_chunks <= 1:
+        return chunks[:1], True
+    return chunks[:max_chunks - 1] + chunks[-1:], True
+
+
+def needs_chunking(text, tokenizer=None, max_tokens=256):
+    """True when the message does not fit in a single chunk"""
+    return _count_tokens(tokenizer, text) > max_tokens
+
+
+def max_scores_per_label(chunk_results):
+    """Merge per-chunk [{"label", "score"}, ...] lists into {label: max score}"""
+    merged = {}
+    for results in chunk_results:
+        for result in results:
+            label, score = result["label"], result["score"]
+            if score > merged.get(label, 0.0):
+                merged[label] = score
+    return merged